@@ -86,7 +86,11 @@ ASGI_APPLICATION = 'config.asgi.application'
 
 DATABASES = {}
 
-SESSION_ENGINE = 'django.contrib.sessions.backends.file'
+# Sessions only carry the examination ID (results live in
+# diagnosis.results_store), so a signed cookie needs no server storage
+SESSION_ENGINE = os.environ.get(
+    'SESSION_ENGINE', 'django.contrib.sessions.backends.signed_cookies'
+)
 SESSION_FILE_PATH = '/tmp/django_sessions'
 SESSION_COOKIE_AGE = 3600
 SESSION_COOKIE_HTTPONLY = True
@@ -118,3 +122,27 @@ FILE_UPLOAD_PERMISSIONS = 0o644
 FILE_UPLOAD_DIRECTORY_PERMISSIONS = 0o700
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# diagnosis loggers write plain lines to stdout; the per-image timing
+# lines from diagnosis.timing are JSON, which Cloud Run stores as
+# structured log entries. PIPELINE_TIMING=0 turns timing off.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'message': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'stdout': {
+            'class': 'logging.StreamHandler',
+            'stream': 'ext://sys.stdout',
+            'formatter': 'message',
+        },
+    },
+    'loggers': {
+        'diagnosis': {
+            'handlers': ['stdout'],
+            'level': os.environ.get('DIAGNOSIS_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
@@ -3,8 +3,11 @@ from django.conf import settings
 from django.views.generic import RedirectView
 from django.views.static import serve
 
+from diagnosis.views import metrics_view
+
 urlpatterns = [
     path('diagnosis/', include('diagnosis.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('', RedirectView.as_view(url='/diagnosis/upload/', permanent=False)),
     re_path(r'^media/(?P<path>.*)$', serve, {'document_root': settings.MEDIA_ROOT}),
 ]
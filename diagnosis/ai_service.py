@@ -1,21 +1,59 @@
 """
 AI service for Gemini image analysis using Google GenAI SDK.
+
+One GenAI client (and its HTTP connection pool) is kept per process and
+reused across requests; async callers get one client per event loop,
+since pooled async connections cannot move between loops.
+
+Extracted metadata is cached on disk by image hash, model and prompt,
+so duplicate uploads and retried analyses skip the Gemini call.
 """
+import asyncio
 import json
 import logging
 import os
+import threading
+import weakref
 from pathlib import Path
 
+import httpx
 from google import genai
 from google.genai import types
 
+from .caching import ResultCache, content_key
+from .image_processing import ImageSource
+from .metrics import GEMINI_REQUEST_SECONDS, GEMINI_REQUESTS
 from .prompts import get_extraction_prompt
+from .timing import collect, log_timings, stage, tag
 
 logger = logging.getLogger(__name__)
 
 API_KEY_PATH = Path(__file__).parent.parent / 'secret' / 'gemini_api.key'
 MODEL_NAME = 'gemini-2.5-flash'
 
+# HTTP settings for the shared client (timeout in milliseconds)
+GEMINI_TIMEOUT_MS = int(os.environ.get('GEMINI_TIMEOUT_MS', '60000'))
+GEMINI_MAX_CONNECTIONS = int(os.environ.get('GEMINI_MAX_CONNECTIONS', '10'))
+
+# Metadata cache: local file store with TTL and a size bound
+GEMINI_CACHE_DIR = os.environ.get('GEMINI_CACHE_DIR', '/tmp/gemini_cache')
+GEMINI_CACHE_TTL = int(os.environ.get('GEMINI_CACHE_TTL', str(30 * 86400)))
+GEMINI_CACHE_MAX_ENTRIES = int(
+    os.environ.get('GEMINI_CACHE_MAX_ENTRIES', '5000')
+)
+_metadata_cache = ResultCache(
+    'gemini_metadata',
+    max_entries=256,
+    directory=GEMINI_CACHE_DIR or None,
+    ttl=GEMINI_CACHE_TTL,
+    max_disk_entries=GEMINI_CACHE_MAX_ENTRIES,
+)
+
+_client_lock = threading.Lock()
+_client: genai.Client | None = None
+# Event loop -> client; entries vanish when their loop is collected
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
 
 def _get_api_key() -> str:
     """Read API key from environment variable, falling back to key file."""
@@ -25,68 +63,190 @@ def _get_api_key() -> str:
     return API_KEY_PATH.read_text().strip()
 
 
+def _create_client() -> genai.Client:
+    """Create a GenAI client for Gemini Developer API with pooled HTTP."""
+    limits = httpx.Limits(
+        max_connections=GEMINI_MAX_CONNECTIONS,
+        max_keepalive_connections=GEMINI_MAX_CONNECTIONS,
+    )
+    http_options = types.HttpOptions(
+        timeout=GEMINI_TIMEOUT_MS,
+        client_args={'limits': limits},
+        async_client_args={'limits': limits},
+    )
+    return genai.Client(
+        api_key=_get_api_key(), vertexai=False, http_options=http_options,
+    )
+
+
 def _get_client() -> genai.Client:
-    """Create and return a GenAI client for Gemini Developer API."""
-    return genai.Client(api_key=_get_api_key(), vertexai=False)
+    """Return the process-wide GenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _create_client()
+    return _client
+
+
+def _get_async_client() -> genai.Client:
+    """Return the GenAI client for the running event loop."""
+    loop = asyncio.get_running_loop()
+    with _client_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = _async_clients[loop] = _create_client()
+    return client
+
+
+def reset_clients() -> None:
+    """Drop cached clients, e.g. after rotating the API key."""
+    global _client
+    with _client_lock:
+        _client = None
+        _async_clients.clear()
+
+
+def _metadata_cache_key(image: ImageSource) -> str:
+    """Cache key covering everything that determines Gemini's answer."""
+    return content_key(image.data, MODEL_NAME, get_extraction_prompt())
+
+
+def _build_request(image: ImageSource) -> dict:
+    """Build generate_content keyword arguments for an image."""
+    prompt = get_extraction_prompt()
+
+    return {
+        'model': MODEL_NAME,
+        'contents': [
+            types.Part.from_bytes(
+                data=image.data, mime_type=image.mime_type,
+            ),
+            prompt
+        ],
+        'config': types.GenerateContentConfig(
+            temperature=0.1,
+        ),
+    }
+
+
+def _parse_response_text(response_text: str) -> dict:
+    """Strip optional markdown fences and parse Gemini's JSON reply."""
+    response_text = response_text.strip()
+
+    # Remove markdown code blocks if present
+    if response_text.startswith('```'):
+        lines = response_text.split('\n')
+        if lines[0].startswith('```'):
+            lines = lines[1:]
+        if lines and lines[-1].strip() == '```':
+            lines = lines[:-1]
+        response_text = '\n'.join(lines)
+
+    return json.loads(response_text)
+
+
+def _error_result(e: Exception) -> dict:
+    """Log and count an analysis failure and convert it to an error dict."""
+    GEMINI_REQUESTS.inc(outcome='error')
+    if isinstance(e, json.JSONDecodeError):
+        logger.error(f"Failed to parse Gemini response as JSON: {e}")
+        return {'error': f'Invalid JSON response: {e}'}
+    if isinstance(e, FileNotFoundError):
+        logger.error(f"API key file not found: {API_KEY_PATH}")
+        return {'error': 'API key not configured'}
+    logger.error(f"Gemini API error: {e}")
+    return {'error': str(e)}
+
 
+def _log_extraction(image: str | ImageSource, result: dict, timings) -> None:
+    """Log one structured timing line for a metadata extraction."""
+    log_timings(
+        'gemini', timings,
+        image=image.name if isinstance(image, ImageSource) else image,
+        success='error' not in result,
+    )
 
-def analyze_training_image(image_path: str) -> dict:
+
+def analyze_training_image(image: str | ImageSource) -> dict:
     """
     Analyze a training result image using Gemini.
 
     Args:
-        image_path: Path to the image file.
+        image: Path to the image file, or an ImageSource already in
+            memory (avoids reading the file again).
 
     Returns:
         Parsed JSON response from Gemini or error dict.
     """
+    with collect() as timings:
+        result = _analyze_training_image(image)
+    _log_extraction(image, result, timings)
+    return result
+
+
+def _analyze_training_image(image: str | ImageSource) -> dict:
+    """Body of analyze_training_image, timed by the caller."""
     try:
+        if not isinstance(image, ImageSource):
+            image = ImageSource.from_path(image)
+        cache_key = _metadata_cache_key(image)
+        cached = _metadata_cache.get(cache_key)
+        if cached is not None:
+            tag('cache', 'hit')
+            GEMINI_REQUESTS.inc(outcome='cache_hit')
+            return cached
+
+        tag('cache', 'miss')
         client = _get_client()
-
-        image_data = Path(image_path).read_bytes()
-
-        # Determine mime type from extension
-        ext = Path(image_path).suffix.lower()
-        mime_type = {
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.png': 'image/png',
-            '.gif': 'image/gif',
-            '.webp': 'image/webp',
-        }.get(ext, 'image/jpeg')
-
-        prompt = get_extraction_prompt()
-
-        response = client.models.generate_content(
-            model=MODEL_NAME,
-            contents=[
-                types.Part.from_bytes(data=image_data, mime_type=mime_type),
-                prompt
-            ],
-            config=types.GenerateContentConfig(
-                temperature=0.1,
+        with stage('gemini'), GEMINI_REQUEST_SECONDS.time():
+            response = client.models.generate_content(
+                **_build_request(image)
             )
-        )
+        result = _parse_response_text(response.text)
+    except Exception as e:
+        return _error_result(e)
 
-        response_text = response.text.strip()
+    GEMINI_REQUESTS.inc(outcome='success')
+    _metadata_cache.set(cache_key, result)
+    return result
 
-        # Remove markdown code blocks if present
-        if response_text.startswith('```'):
-            lines = response_text.split('\n')
-            if lines[0].startswith('```'):
-                lines = lines[1:]
-            if lines and lines[-1].strip() == '```':
-                lines = lines[:-1]
-            response_text = '\n'.join(lines)
 
-        return json.loads(response_text)
+async def analyze_training_image_async(image: str | ImageSource) -> dict:
+    """
+    Analyze a training result image using the async Gemini client.
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Failed to parse Gemini response as JSON: {e}")
-        return {'error': f'Invalid JSON response: {e}'}
-    except FileNotFoundError:
-        logger.error(f"API key file not found: {API_KEY_PATH}")
-        return {'error': 'API key not configured'}
+    Same contract as analyze_training_image, but awaits the request
+    instead of blocking a thread while Gemini responds.
+    """
+    with collect() as timings:
+        result = await _analyze_training_image_async(image)
+    _log_extraction(image, result, timings)
+    return result
+
+
+async def _analyze_training_image_async(image: str | ImageSource) -> dict:
+    """Body of analyze_training_image_async, timed by the caller."""
+    try:
+        if not isinstance(image, ImageSource):
+            image = await asyncio.to_thread(ImageSource.from_path, image)
+        cache_key = _metadata_cache_key(image)
+        cached = await _metadata_cache.aget(cache_key)
+        if cached is not None:
+            tag('cache', 'hit')
+            GEMINI_REQUESTS.inc(outcome='cache_hit')
+            return cached
+
+        tag('cache', 'miss')
+        client = _get_async_client()
+        with stage('gemini'), GEMINI_REQUEST_SECONDS.time():
+            response = await client.aio.models.generate_content(
+                **_build_request(image)
+            )
+        result = _parse_response_text(response.text)
     except Exception as e:
-        logger.error(f"Gemini API error: {e}")
-        return {'error': str(e)}
+        return _error_result(e)
+
+    GEMINI_REQUESTS.inc(outcome='success')
+    await _metadata_cache.aset(cache_key, result)
+    return result
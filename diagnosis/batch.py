@@ -0,0 +1,327 @@
+"""
+Batch execution of per-image analysis.
+
+Each uploaded image needs grid parsing (OpenCV) and a Gemini metadata
+request, and a batch's images are processed concurrently so it takes
+roughly as long as its slowest image instead of the sum of all images.
+The views read a batch's files once (load_batch) and hand the same
+items to grid parsing and to the metadata job.
+
+Grid parsing runs on a thread pool sized to the CPU count. OpenCV
+releases the GIL, so threads give real parallelism without pickling
+images across processes. The pool is process-wide, so concurrent
+requests share (and are bounded by) the same workers. The web views
+only wait for grid parsing (parse_grids_async, iter_analysis_async).
+
+Gemini requests are network-bound and are awaited on the event loop
+with the async client, in a background job (start_metadata_job) whose
+status and results are kept in a small file store keyed by examination
+ID, so the result page can render before Gemini answers and poll for
+the metadata.
+
+With the job queue enabled (see job_queue), the web process does no
+image work itself: each image becomes a 'grid' and a 'metadata' job
+that manage.py analysis_worker runs via run_queued_job, and the views
+only wait on the results.
+"""
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import job_queue
+from .ai_service import (
+    GEMINI_TIMEOUT_MS,
+    analyze_training_image,
+    analyze_training_image_async,
+)
+from .caching import ResultCache
+from .image_processing import ImageSource, parse_grid
+from .metrics import CV_POOL_WORKERS, GRID_PARSES_IN_PROGRESS, JOB_QUEUE_JOBS
+
+logger = logging.getLogger(__name__)
+
+CV_MAX_WORKERS = os.cpu_count() or 1
+
+cv_executor = ThreadPoolExecutor(
+    max_workers=CV_MAX_WORKERS, thread_name_prefix='grid-cv',
+)
+CV_POOL_WORKERS.set(CV_MAX_WORKERS)
+if job_queue.JOB_QUEUE_ENABLED:
+    JOB_QUEUE_JOBS.set_function(job_queue.count_active)
+
+# Background metadata jobs: status per examination, shared on disk
+METADATA_JOB_DIR = os.environ.get('METADATA_JOB_DIR', '/tmp/metadata_jobs')
+METADATA_JOB_TTL = int(os.environ.get('METADATA_JOB_TTL', str(86400)))
+# Pending jobs older than this are assumed lost (e.g. process restart).
+# Queued jobs may wait JOB_WAIT_TIMEOUT for a worker, so with the queue
+# the bound outlasts that and a job still waiting is never started
+# twice. In-process, a job's Gemini calls run concurrently and each
+# waits up to GEMINI_TIMEOUT_MS for a pooled connection and again for
+# the response (the client does not retry).
+if job_queue.JOB_QUEUE_ENABLED:
+    _METADATA_JOB_BOUND = job_queue.JOB_WAIT_TIMEOUT + 60
+else:
+    _METADATA_JOB_BOUND = 2 * GEMINI_TIMEOUT_MS // 1000 + 30
+METADATA_JOB_TIMEOUT = int(os.environ.get(
+    'METADATA_JOB_TIMEOUT', str(_METADATA_JOB_BOUND),
+))
+METADATA_PENDING = 'pending'
+METADATA_DONE = 'done'
+_metadata_jobs = ResultCache(
+    'metadata_jobs',
+    max_entries=256,
+    directory=METADATA_JOB_DIR or None,
+    ttl=METADATA_JOB_TTL,
+)
+# Strong references so running jobs are not garbage collected
+_background_tasks: set[asyncio.Task] = set()
+# Examinations whose metadata job runs in this process
+_running_jobs: set[str] = set()
+
+# Job kinds run by queue workers
+GRID_JOB = 'grid'
+METADATA_JOB = 'metadata'
+
+
+def empty_grid() -> dict:
+    """Grid result used when an image could not be parsed."""
+    return {
+        'success': False,
+        'grid_color': [None] * 81,
+        'grid_size': [0] * 81,
+    }
+
+
+def parse_grid_stripped(source: ImageSource) -> dict:
+    """Parse a grid, keeping only the fields stored with the results."""
+    try:
+        parsed_result = parse_grid(source)
+    except Exception:
+        logger.exception("Grid parsing failed for %s", source.name)
+        parsed_result = empty_grid()
+
+    return {
+        'success': parsed_result.get('success', False),
+        'grid_color': parsed_result.get('grid_color', [None] * 81),
+        'grid_size': parsed_result.get('grid_size', [0] * 81),
+    }
+
+
+def extract_metadata(source: ImageSource) -> dict:
+    """Run Gemini metadata extraction, returning an error dict on failure."""
+    try:
+        return analyze_training_image(source)
+    except Exception as e:
+        logger.exception("AI analysis failed for %s", source.name)
+        return {'error': str(e)}
+
+
+async def extract_metadata_async(source: ImageSource) -> dict:
+    """Async variant of extract_metadata using the async Gemini client."""
+    try:
+        return await analyze_training_image_async(source)
+    except Exception as e:
+        logger.exception("AI analysis failed for %s", source.name)
+        return {'error': str(e)}
+
+
+def load_sources(image_paths: list[str]) -> list[ImageSource]:
+    """Read each existing image once, skipping missing or unreadable files."""
+    sources = []
+    for image_path in image_paths:
+        if not os.path.exists(image_path):
+            logger.warning("Image file missing: %s", image_path)
+            continue
+        try:
+            sources.append(ImageSource.from_path(image_path))
+        except OSError:
+            logger.exception("Could not read image %s", image_path)
+    return sources
+
+
+def run_queued_job(kind: str, payload: dict) -> dict:
+    """Run one queued job in a worker process and return its result."""
+    image_path = payload['image_path']
+    if kind not in (GRID_JOB, METADATA_JOB):
+        raise ValueError(f'Unknown job kind: {kind}')
+    try:
+        source = ImageSource.from_path(image_path)
+    except OSError as e:
+        logger.exception("Could not read image %s", image_path)
+        return empty_grid() if kind == GRID_JOB else {'error': str(e)}
+
+    if kind == GRID_JOB:
+        return parse_grid_stripped(source)
+    return extract_metadata(source)
+
+
+async def load_batch(image_paths: list[str]) -> list:
+    """
+    Work items for a batch: the paths of existing files when queue
+    workers do the reading, else ImageSources read on the CV pool.
+
+    Items are in upload order, skipping missing or unreadable files,
+    and can be passed to parse_grids_async, iter_analysis_async and
+    start_metadata_job alike.
+    """
+    if job_queue.JOB_QUEUE_ENABLED:
+        existing = []
+        for image_path in image_paths:
+            if os.path.exists(image_path):
+                existing.append(image_path)
+            else:
+                logger.warning("Image file missing: %s", image_path)
+        return existing
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cv_executor, load_sources, image_paths)
+
+
+async def _parse_item(item: str | ImageSource) -> dict:
+    """Parse one work item's grid on a queue worker or the CV pool."""
+    with GRID_PARSES_IN_PROGRESS.track_inprogress():
+        if job_queue.JOB_QUEUE_ENABLED:
+            try:
+                return await job_queue.run_job(
+                    GRID_JOB, {'image_path': item},
+                )
+            except job_queue.JobFailed:
+                logger.exception("Grid job failed for %s", item)
+                return empty_grid()
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            cv_executor, parse_grid_stripped, item,
+        )
+
+
+async def _extract_item(item: str | ImageSource) -> dict:
+    """Extract one work item's metadata on a queue worker or the loop."""
+    if job_queue.JOB_QUEUE_ENABLED:
+        try:
+            return await job_queue.run_job(METADATA_JOB, {'image_path': item})
+        except job_queue.JobFailed as e:
+            logger.exception("Metadata job failed for %s", item)
+            return {'error': str(e)}
+
+    return await extract_metadata_async(item)
+
+
+async def parse_grids_async(items: list) -> list[dict]:
+    """Parse grids for a batch loaded with load_batch."""
+    parsed_grids = await asyncio.gather(*(_parse_item(item) for item in items))
+    return list(parsed_grids)
+
+
+async def iter_analysis_async(items: list):
+    """
+    Stream grid parsing for a batch loaded with load_batch as each image
+    completes.
+
+    Yields events as tuples:
+
+    - ('start', image_count) first
+    - ('grid', index, parsed_grid) per image, in completion order;
+      index is the image's position in items
+
+    Work still pending when the consumer stops early is cancelled.
+    """
+    yield ('start', len(items))
+
+    async def parse(index: int, item: str | ImageSource) -> tuple[int, dict]:
+        return index, await _parse_item(item)
+
+    grid_tasks = [
+        asyncio.ensure_future(parse(index, item))
+        for index, item in enumerate(items)
+    ]
+
+    try:
+        for next_grid in asyncio.as_completed(grid_tasks):
+            index, grid = await next_grid
+            yield ('grid', index, grid)
+    finally:
+        for task in grid_tasks:
+            task.cancel()
+
+
+def get_metadata_job(examination_id: str) -> dict | None:
+    """
+    Return the metadata job for an examination, or None if unknown.
+
+    Jobs are dicts with 'status' (METADATA_PENDING or METADATA_DONE)
+    and, once done, 'ai_results' in upload order.
+    """
+    return _metadata_jobs.get(examination_id)
+
+
+async def aget_metadata_job(examination_id: str) -> dict | None:
+    """get_metadata_job for async code; file reads run in a thread."""
+    return await _metadata_jobs.aget(examination_id)
+
+
+async def _run_metadata_job(
+    examination_id: str,
+    image_paths: list[str],
+    items: list | None,
+):
+    try:
+        if items is None:
+            items = await load_batch(image_paths)
+        ai_results = await asyncio.gather(
+            *(_extract_item(item) for item in items)
+        )
+    except Exception:
+        logger.exception("Metadata job failed for %s", examination_id)
+        ai_results = []
+    try:
+        await _metadata_jobs.aset(examination_id, {
+            'status': METADATA_DONE,
+            'ai_results': list(ai_results),
+        })
+    finally:
+        _running_jobs.discard(examination_id)
+
+
+async def start_metadata_job(
+    examination_id: str,
+    image_paths: list[str],
+    items: list | None = None,
+) -> None:
+    """
+    Start metadata extraction for an examination in the background.
+
+    items are the batch's load_batch items when the caller has already
+    read the files for grid parsing; without them (e.g. when a poll
+    restarts a lost job) the job reads image_paths itself.
+
+    Does nothing if a job for the examination is running in this
+    process, is done, or was started less than METADATA_JOB_TIMEOUT
+    seconds ago.
+    """
+    if examination_id in _running_jobs:
+        return
+    job = await aget_metadata_job(examination_id)
+    # Re-check: another request may have started the job meanwhile
+    if examination_id in _running_jobs or job is not None and (
+        job['status'] == METADATA_DONE
+        or time.time() - job['started_at'] < METADATA_JOB_TIMEOUT
+    ):
+        return
+
+    _running_jobs.add(examination_id)
+    try:
+        await _metadata_jobs.aset(examination_id, {
+            'status': METADATA_PENDING,
+            'started_at': time.time(),
+        })
+    except BaseException:
+        _running_jobs.discard(examination_id)
+        raise
+    task = asyncio.get_running_loop().create_task(
+        _run_metadata_job(examination_id, image_paths, items)
+    )
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
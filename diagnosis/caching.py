@@ -0,0 +1,231 @@
+"""
+Content-addressed result caches.
+
+ResultCache keeps JSON-serializable results in an in-memory LRU and,
+optionally, in a directory on disk that survives restarts and is
+shared by processes on the same volume. Values are stored as JSON
+text, so every hit returns a fresh copy that callers may mutate.
+Entries can expire after a TTL, and the disk tier can be capped, in
+which case the oldest files are removed first.
+
+aget()/aset() are the variants for async code: the memory tier is
+used directly and only disk access runs in a worker thread.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# A capped disk tier is pruned down to this fraction of max_disk_entries,
+# so the directory is only scanned again after that many new writes
+DISK_PRUNE_TARGET = 0.9
+
+
+def content_key(*parts: bytes | str) -> str:
+    """Hash bytes and strings into a hex key for cache lookups."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of JSON values with an optional disk tier.
+
+    Args:
+        namespace: Subdirectory name for the disk tier
+        max_entries: Entries kept in memory before evicting the oldest
+        directory: Root directory for the disk tier, or None for
+            memory only
+        ttl: Seconds an entry stays valid after it is stored, or None
+            to keep entries until evicted
+        max_disk_entries: Files kept in the disk tier before removing
+            the oldest, or None for no limit. Files are counted
+            approximately between scans (writes by other processes are
+            only seen at the next scan), so the directory is listed once
+            per DISK_PRUNE_TARGET headroom of writes, not on every set.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        max_entries: int = 256,
+        directory: Optional[str | Path] = None,
+        ttl: Optional[float] = None,
+        max_disk_entries: Optional[int] = None,
+    ):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.directory = Path(directory) / namespace if directory else None
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        self._entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Approximate disk entry count; None until the first scan
+        self._disk_count: Optional[int] = None
+        self._prune_lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f'{key}.json'
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value for key, or None on a miss."""
+        entry = self._memory_entry(key)
+        if entry is None and self.directory is not None:
+            entry = self._disk_entry(key)
+
+        if entry is None:
+            return None
+        return json.loads(entry[1])
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """get() that reads the disk tier in a worker thread."""
+        entry = self._memory_entry(key)
+        if entry is None and self.directory is not None:
+            entry = await asyncio.to_thread(self._disk_entry, key)
+
+        if entry is None:
+            return None
+        return json.loads(entry[1])
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a JSON-serializable value under key."""
+        text = json.dumps(value, ensure_ascii=False)
+        self._remember(key, time.time(), text)
+
+        if self.directory is not None:
+            self._store_on_disk(key, text)
+
+    async def aset(self, key: str, value: Any) -> None:
+        """set() that writes the disk tier in a worker thread."""
+        text = json.dumps(value, ensure_ascii=False)
+        self._remember(key, time.time(), text)
+
+        if self.directory is not None:
+            await asyncio.to_thread(self._store_on_disk, key, text)
+
+    def _memory_entry(self, key: str) -> Optional[tuple[float, str]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._expired(entry[0]):
+                    del self._entries[key]
+                    return None
+                self._entries.move_to_end(key)
+        return entry
+
+    def _disk_entry(self, key: str) -> Optional[tuple[float, str]]:
+        entry = self._read(key)
+        if entry is not None:
+            self._remember(key, *entry)
+        return entry
+
+    def _store_on_disk(self, key: str, text: str) -> None:
+        try:
+            self._write(self._path(key), text)
+            if self.max_disk_entries is not None and self._count_write():
+                self._prune_disk()
+        except OSError:
+            logger.warning(
+                "Could not write %s cache entry %s", self.namespace, key,
+            )
+
+    def _count_write(self) -> bool:
+        """Count a disk write; True if the directory should be pruned."""
+        with self._lock:
+            if self._disk_count is None:
+                return True
+            self._disk_count += 1
+            return self._disk_count > self.max_disk_entries
+
+    def clear(self) -> None:
+        """Drop all in-memory entries (the disk tier is kept)."""
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, key: str, stored_at: float, text: str) -> None:
+        with self._lock:
+            self._entries[key] = (stored_at, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read(self, key: str) -> Optional[tuple[float, str]]:
+        """Read a disk entry; its file mtime is when it was stored."""
+        path = self._path(key)
+        try:
+            stored_at = path.stat().st_mtime
+            if self._expired(stored_at):
+                path.unlink(missing_ok=True)
+                return None
+            return stored_at, path.read_text(encoding='utf-8')
+        except OSError:
+            return None
+
+    def _prune_disk(self) -> None:
+        """
+        Scan the disk tier, removing expired files and, once it is over
+        max_disk_entries, the oldest down to DISK_PRUNE_TARGET of the
+        limit.
+        """
+        # One scan at a time; writes during a scan are counted after it
+        if not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            files = []
+            with os.scandir(self.directory) as it:
+                for item in it:
+                    if not item.name.endswith('.json'):
+                        continue
+                    stored_at = item.stat().st_mtime
+                    if self._expired(stored_at):
+                        try:
+                            os.unlink(item.path)
+                        except FileNotFoundError:
+                            pass
+                    else:
+                        files.append((stored_at, item.path))
+
+            remaining = len(files)
+            if remaining > self.max_disk_entries:
+                keep = int(self.max_disk_entries * DISK_PRUNE_TARGET)
+                for _, path in sorted(files)[:remaining - keep]:
+                    try:
+                        os.unlink(path)
+                    except FileNotFoundError:
+                        pass
+                remaining = keep
+
+            with self._lock:
+                self._disk_count = remaining
+        finally:
+            self._prune_lock.release()
+
+    @staticmethod
+    def _write(path: Path, text: str) -> None:
+        """Write atomically so readers never see a partial entry."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
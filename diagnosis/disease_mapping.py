@@ -1,15 +1,20 @@
 """
 Disease matching service.
 
-Loads disease data from JSON and provides matching logic.
+Loads disease data from JSON and provides matching logic. Definitions
+are compiled once into NumPy matrices (one row per disease, one column
+per cell) and reloaded when the JSON file changes, so scoring every
+disease for a hand is a matrix-vector product.
 
 Hand color mapping:
 - CYAN = Left hand (左手)
 - GREEN = Right hand (右手)
 """
 import json
+import threading
 from pathlib import Path
-from statistics import median
+
+import numpy as np
 
 DISEASES_PATH = Path(__file__).parent.parent / 'data' / 'diseases.json'
 
@@ -20,10 +25,63 @@ COLOR_SCORES: dict[str, int] = {'RED': 3, 'YELLOW': 2, 'BLUE': 1}
 MAX_CIRCLE_SIZE = 5
 
 
+class CompiledDiseases:
+    """
+    Disease definitions compiled into scoring matrices.
+
+    Attributes:
+        diseases: Disease dicts as loaded from JSON
+        by_id: The same disease dicts keyed by ID
+        mtime: Modification time (ns) of the JSON file they came from
+        weights: (diseases, 81) COLOR_SCORES weight per pattern cell,
+            unknown colors weigh 1, empty cells 0
+        simulate_weights: Same, but unknown colors weigh 0
+        serious_masks: (diseases, 81) cells of each pattern's serious
+            target color (RED if the pattern has any, else YELLOW)
+    """
+
+    def __init__(self, diseases: list[dict], mtime: int):
+        self.diseases = diseases
+        self.by_id = {disease['id']: disease for disease in diseases}
+        self.mtime = mtime
+
+        patterns = [disease['grid_color'] for disease in diseases]
+        self.weights = np.array([
+            [0 if c is None else COLOR_SCORES.get(c, 1) for c in pattern]
+            for pattern in patterns
+        ], dtype=np.int64).reshape(len(diseases), 81)
+        self.simulate_weights = np.array([
+            [0 if c is None else COLOR_SCORES.get(c, 0) for c in pattern]
+            for pattern in patterns
+        ], dtype=np.int64).reshape(len(diseases), 81)
+        self.serious_masks = np.array([
+            [c == _serious_target_color(pattern) for c in pattern]
+            for pattern in patterns
+        ], dtype=np.int64).reshape(len(diseases), 81)
+
+
+_compiled_lock = threading.Lock()
+_compiled: CompiledDiseases | None = None
+
+
+def get_compiled_diseases() -> CompiledDiseases:
+    """Return the compiled disease model, reloading if the JSON changed."""
+    global _compiled
+    mtime = DISEASES_PATH.stat().st_mtime_ns
+    compiled = _compiled
+    if compiled is not None and compiled.mtime == mtime:
+        return compiled
+
+    with _compiled_lock:
+        if _compiled is None or _compiled.mtime != mtime:
+            with open(DISEASES_PATH, encoding='utf-8') as f:
+                _compiled = CompiledDiseases(json.load(f), mtime)
+        return _compiled
+
+
 def _load_diseases() -> list[dict]:
-    """Load disease definitions from JSON file."""
-    with open(DISEASES_PATH, encoding='utf-8') as f:
-        return json.load(f)
+    """Load disease definitions (cached until the JSON file changes)."""
+    return get_compiled_diseases().diseases
 
 
 def get_all_diseases() -> list[dict]:
@@ -78,59 +136,66 @@ def _has_red_cells(disease_grid_color: list) -> bool:
     return 'RED' in disease_grid_color
 
 
-def _is_serious_for_hand(
-    grid_color: list,
-    grid_size: list,
-    disease_grid_color: list,
+def _serious_target_color(disease_grid_color: list) -> str:
+    """Pattern color whose cells decide the serious check."""
+    return 'RED' if _has_red_cells(disease_grid_color) else 'YELLOW'
+
+
+def _size_array(grid_sizes) -> np.ndarray:
+    """Convert sizes (None for no circle) to an int64 array."""
+    sizes = np.asarray(grid_sizes)
+    if sizes.dtype == object:
+        sizes = np.where(sizes == None, 0, sizes)  # noqa: E711
+    return sizes.astype(np.int64)
+
+
+def score_grids_batch(
+    grid_colors,
+    grid_sizes,
     hand_color: str,
-) -> bool:
+) -> np.ndarray:
     """
-    Determine if a disease meets serious criteria for a specific hand.
+    Score every disease for one hand across many merged grids at once.
 
-    For diseases with RED grids: serious if any matching red cell has
+    Score: sum of circle size (clamped to 1-5) times the pattern cell's
+    COLOR_SCORES weight over cells with the hand's color.
+
+    Serious: for diseases with RED grids, any matching red cell has
     circle size 5, or 2+ matching red cells have circle size >= 4.
     For diseases without RED grids: same check using YELLOW cells.
+
+    Args:
+        grid_colors: (N, 81) color names, None for empty cells
+        grid_sizes: (N, 81) circle sizes, 0 or None for no circle
+        hand_color: LEFT_HAND_COLOR or RIGHT_HAND_COLOR
+
+    Returns:
+        int64 array of shape (N, diseases, 2) holding the score and the
+        serious flag (0/1), diseases in catalog order.
     """
-    target_color = 'RED' if _has_red_cells(disease_grid_color) else 'YELLOW'
+    compiled = get_compiled_diseases()
+    on_hand = np.asarray(grid_colors, dtype=object).reshape(-1, 81)
+    on_hand = on_hand == hand_color
+    raw_sizes = _size_array(grid_sizes).reshape(-1, 81)
 
-    matching_sizes: list[int] = []
-    for i in range(81):
-        if disease_grid_color[i] != target_color:
-            continue
-        if grid_color[i] != hand_color:
-            continue
-        size = grid_size[i] if grid_size else 0
-        size = max(0, min(MAX_CIRCLE_SIZE, size or 0))
-        if size > 0:
-            matching_sizes.append(size)
-
-    if any(s >= SERIOUS_SIZE_THRESHOLD for s in matching_sizes):
-        return True
-    count_large = sum(
-        1 for s in matching_sizes if s >= SERIOUS_COUNT_THRESHOLD
-    )
-    return count_large >= SERIOUS_COUNT_MIN
+    score_sizes = np.where(on_hand, np.clip(raw_sizes, 1, MAX_CIRCLE_SIZE), 0)
+    scores = score_sizes @ compiled.weights.T
 
+    sizes = np.where(on_hand, np.clip(raw_sizes, 0, MAX_CIRCLE_SIZE), 0)
+    masks = compiled.serious_masks.T
+    count_max = (sizes >= SERIOUS_SIZE_THRESHOLD).astype(np.int64) @ masks
+    count_large = (sizes >= SERIOUS_COUNT_THRESHOLD).astype(np.int64) @ masks
+    is_serious = (count_max > 0) | (count_large >= SERIOUS_COUNT_MIN)
+
+    return np.stack([scores, is_serious.astype(np.int64)], axis=-1)
 
-def _score_disease_for_hand(
-    grid_color: list,
-    grid_size: list,
-    disease_grid_color: list,
-    hand_color: str
-) -> int:
-    """Calculate weighted score for a single disease on one hand."""
-    score = 0
-    for i in range(81):
-        disease_cell = disease_grid_color[i]
-        if disease_cell is None:
-            continue
-        if grid_color[i] != hand_color:
-            continue
-        size = grid_size[i] if grid_size else 1
-        size = max(1, min(MAX_CIRCLE_SIZE, size or 1))
-        color_weight = COLOR_SCORES.get(disease_cell, 1)
-        score += size * color_weight
-    return score
+
+def _median_colors(grid_colors: np.ndarray, present: np.ndarray) -> list:
+    """Per cell, the last detected color, or None where the median is 0."""
+    detected = grid_colors != None  # noqa: E711
+    last = len(grid_colors) - 1 - np.argmax(detected[::-1], axis=0)
+    colors = grid_colors[last, np.arange(81)]
+    return np.where(detected.any(axis=0) & present, colors, None).tolist()
 
 
 def _build_median_grid(parsed_grids: list[dict]) -> tuple[list, list]:
@@ -143,27 +208,69 @@ def _build_median_grid(parsed_grids: list[dict]) -> tuple[list, list]:
     Returns:
         Tuple of (grid_color, grid_size) each with 81 elements.
     """
-    cell_colors: list[str | None] = [None] * 81
-    cell_sizes: list[list[int]] = [[] for _ in range(81)]
+    grids = [grid for grid in parsed_grids if grid.get('success')]
+    if not grids:
+        return [None] * 81, [0] * 81
 
-    for grid in parsed_grids:
-        if not grid.get('success'):
-            continue
-        grid_color = grid.get('grid_color', [None] * 81)
-        grid_size = grid.get('grid_size', [0] * 81)
-        for i in range(81):
-            if grid_color[i] is not None:
-                cell_colors[i] = grid_color[i]
-            cell_sizes[i].append(grid_size[i] or 0)
-
-    median_sizes = [0] * 81
-    for i in range(81):
-        if cell_sizes[i]:
-            median_sizes[i] = round(median(cell_sizes[i]))
-        if median_sizes[i] == 0:
-            cell_colors[i] = None
+    grid_colors = np.array(
+        [grid.get('grid_color', [None] * 81) for grid in grids], dtype=object,
+    )
+    grid_sizes = _size_array(
+        [grid.get('grid_size', [0] * 81) for grid in grids]
+    )
 
-    return cell_colors, median_sizes
+    # np.round rounds halves to even, like round() on statistics.median
+    median_sizes = np.round(np.median(grid_sizes, axis=0)).astype(np.int64)
+    return _median_colors(grid_colors, median_sizes != 0), median_sizes.tolist()
+
+
+class MedianGridAccumulator:
+    """
+    Incrementally merged median grid.
+
+    Keeps a count of each circle size (0-5) per cell, so adding an image
+    and reading the merged grid are both O(81) instead of recomputing
+    the median over every image. Gives the same grid as
+    _build_median_grid over the images added so far.
+    """
+
+    def __init__(self):
+        self.image_count = 0
+        self._size_counts = np.zeros((81, MAX_CIRCLE_SIZE + 1), dtype=np.int64)
+        self._colors: list[str | None] = [None] * 81
+
+    def add(self, parsed_grid: dict) -> None:
+        """Add one parse_grid result; failed parses are ignored."""
+        if not parsed_grid.get('success'):
+            return
+        grid_color = parsed_grid.get('grid_color', [None] * 81)
+        sizes = np.clip(
+            _size_array(parsed_grid.get('grid_size', [0] * 81)),
+            0, MAX_CIRCLE_SIZE,
+        )
+        self._size_counts[np.arange(81), sizes] += 1
+        self._colors = [
+            color if color is not None else previous
+            for color, previous in zip(grid_color, self._colors)
+        ]
+        self.image_count += 1
+
+    def median_grid(self) -> tuple[list, list]:
+        """Return (grid_color, grid_size) for the images added so far."""
+        if self.image_count == 0:
+            return [None] * 81, [0] * 81
+
+        # The median averages the sizes at the two middle ranks
+        cumulative = np.cumsum(self._size_counts, axis=1)
+        low = np.argmax(cumulative > (self.image_count - 1) // 2, axis=1)
+        high = np.argmax(cumulative > self.image_count // 2, axis=1)
+        median_sizes = np.round((low + high) / 2).astype(np.int64)
+
+        grid_color = [
+            color if size else None
+            for color, size in zip(self._colors, median_sizes.tolist())
+        ]
+        return grid_color, median_sizes.tolist()
 
 
 def accumulate_disease_scores(parsed_grids: list[dict]) -> dict:
@@ -179,8 +286,25 @@ def accumulate_disease_scores(parsed_grids: list[dict]) -> dict:
     Returns:
         Dictionary with left_hand, right_hand analysis and image_count.
     """
-    diseases = _load_diseases()
     median_color, median_size = _build_median_grid(parsed_grids)
+    return score_merged_grid(median_color, median_size, len(parsed_grids))
+
+
+def score_merged_grid(
+    median_color: list,
+    median_size: list,
+    image_count: int,
+) -> dict:
+    """
+    Score diseases for an already merged grid.
+
+    Used by accumulate_disease_scores and with MedianGridAccumulator
+    when results are updated image by image.
+
+    Returns:
+        Dictionary with left_hand, right_hand analysis and image_count.
+    """
+    diseases = get_compiled_diseases().diseases
 
     hand_dot_counts = {'left': 0, 'right': 0}
     for i in range(81):
@@ -189,21 +313,16 @@ def accumulate_disease_scores(parsed_grids: list[dict]) -> dict:
         elif median_color[i] == RIGHT_HAND_COLOR:
             hand_dot_counts['right'] += 1
 
-    hand_scores: dict[str, dict[int, int]] = {
-        'left': {},
-        'right': {},
-    }
-    for disease in diseases:
+    hand_scores = {
+        hand: score_grids_batch(
+            [median_color], [median_size or [0] * 81], hand_color,
+        )[0]
         for hand, hand_color in [('left', LEFT_HAND_COLOR),
-                                 ('right', RIGHT_HAND_COLOR)]:
-            score = _score_disease_for_hand(
-                median_color, median_size,
-                disease['grid_color'], hand_color
-            )
-            hand_scores[hand][disease['id']] = score
+                                 ('right', RIGHT_HAND_COLOR)]
+    }
 
     result = {
-        'image_count': len(parsed_grids),
+        'image_count': image_count,
         'merged_grid': {
             'grid_color': median_color,
             'grid_size': median_size,
@@ -214,40 +333,27 @@ def accumulate_disease_scores(parsed_grids: list[dict]) -> dict:
         hand_color = (
             LEFT_HAND_COLOR if hand == 'left' else RIGHT_HAND_COLOR
         )
-        all_diseases = []
-        for disease in diseases:
-            score = hand_scores[hand][disease['id']]
-            is_serious = _is_serious_for_hand(
-                median_color, median_size,
-                disease['grid_color'], hand_color
-            )
-            severity = POSSIBLE_SEVERITY if is_serious else (
-                ATTENTION_SEVERITY if score > 0 else None
-            )
-            report_data = disease.get('report', {})
-            report_sections = _build_report_sections(report_data, severity)
-            disclaimer = report_data.get('disclaimer', '')
-            all_diseases.append({
+        scores = []
+        for disease, (score, serious) in zip(
+            diseases, hand_scores[hand].tolist()
+        ):
+            is_serious = bool(serious)
+            scores.append({
                 'id': disease['id'],
-                'name_zh': disease['name_zh'],
-                'name_en': disease['name_en'],
-                'symptoms': disease['symptoms'],
-                'report_sections': report_sections,
-                'disclaimer': disclaimer,
                 'score': score,
                 'is_serious': is_serious,
-                'severity': severity,
-                'severity_zh': SEVERITY_LABELS.get(severity, ''),
+                'severity': POSSIBLE_SEVERITY if is_serious else (
+                    ATTENTION_SEVERITY if score > 0 else None
+                ),
             })
 
-        all_diseases.sort(key=lambda d: d['score'], reverse=True)
+        scores.sort(key=lambda d: d['score'], reverse=True)
 
-        possible = [
-            d for d in all_diseases if d['is_serious']
+        possible_ids = [
+            d['id'] for d in scores if d['is_serious']
         ][:MAX_DISPLAY_PER_GROUP]
-        possible_ids = {d['id'] for d in possible}
-        attention = [
-            d for d in all_diseases
+        attention_ids = [
+            d['id'] for d in scores
             if d['score'] > 0 and d['id'] not in possible_ids
         ][:MAX_DISPLAY_PER_GROUP]
 
@@ -256,14 +362,71 @@ def accumulate_disease_scores(parsed_grids: list[dict]) -> dict:
             'hand_zh': hand_zh,
             'color': hand_color,
             'dot_count': hand_dot_counts[hand],
-            'possible_diseases': possible,
-            'attention_diseases': attention,
-            'all_diseases': all_diseases,
+            'possible_ids': possible_ids,
+            'attention_ids': attention_ids,
+            'scores': scores,
         }
 
     return result
 
 
+def expand_disease_results(accumulated: dict) -> dict:
+    """
+    Join compact scores with disease text from the catalog for display.
+
+    accumulate_disease_scores stores only IDs, scores and severities per
+    hand; this adds names, symptoms, report sections at each disease's
+    severity and the disclaimer. Diseases no longer in the catalog are
+    left out.
+
+    Returns:
+        Copy of accumulated where each hand has possible_diseases,
+        attention_diseases and all_diseases lists of full disease dicts.
+    """
+    by_id = get_compiled_diseases().by_id
+    expanded = dict(accumulated)
+
+    for hand_key in ('left_hand', 'right_hand'):
+        if hand_key not in accumulated:
+            continue
+        hand = dict(accumulated[hand_key])
+        all_diseases = []
+        for entry in hand.pop('scores'):
+            disease = by_id.get(entry['id'])
+            if disease is None:
+                continue
+            severity = entry['severity']
+            report_data = disease.get('report', {})
+            all_diseases.append({
+                'id': disease['id'],
+                'name_zh': disease['name_zh'],
+                'name_en': disease['name_en'],
+                'symptoms': disease['symptoms'],
+                'report_sections': _build_report_sections(
+                    report_data, severity,
+                ),
+                'disclaimer': report_data.get('disclaimer', ''),
+                'score': entry['score'],
+                'is_serious': entry['is_serious'],
+                'severity': severity,
+                'severity_zh': SEVERITY_LABELS.get(severity, ''),
+            })
+
+        expanded_by_id = {d['id']: d for d in all_diseases}
+        hand['possible_diseases'] = [
+            expanded_by_id[i] for i in hand.pop('possible_ids')
+            if i in expanded_by_id
+        ]
+        hand['attention_diseases'] = [
+            expanded_by_id[i] for i in hand.pop('attention_ids')
+            if i in expanded_by_id
+        ]
+        hand['all_diseases'] = all_diseases
+        expanded[hand_key] = hand
+
+    return expanded
+
+
 def simulate_disease_scores(
     user_grid: list[int],
     light_min: int = 4,
@@ -271,7 +434,7 @@ def simulate_disease_scores(
     mild_max: int = 18,
 ) -> dict:
     """Score diseases against a user grid without hand filtering."""
-    diseases = _load_diseases()
+    compiled = get_compiled_diseases()
     min_display = light_min
     rank_gap = 3
     thresholds = {
@@ -280,16 +443,11 @@ def simulate_disease_scores(
         'serious': (mild_max + 1, float('inf')),
     }
 
+    user_sizes = np.array(user_grid)
+    scores = compiled.simulate_weights @ np.where(user_sizes > 0, user_sizes, 0)
+
     scored = []
-    for disease in diseases:
-        score = sum(
-            user_grid[i] * COLOR_SCORES.get(
-                disease['grid_color'][i], 0
-            )
-            for i in range(81)
-            if user_grid[i] > 0
-            and disease['grid_color'][i] is not None
-        )
+    for disease, score in zip(compiled.diseases, scores.tolist()):
         severity = None
         if score >= min_display:
             for level, (lo, hi) in thresholds.items():
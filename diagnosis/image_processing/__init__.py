@@ -1,20 +1,34 @@
 """Image processing module for grid detection and analysis."""
 
-from .grid_detector import detect_grid_by_color, extract_cells
+from .grid_detector import (
+    cell_rects,
+    detect_grid,
+    detect_grid_by_color,
+    extract_cells,
+    scale_grid_info,
+)
 from .cell_analyzer import (
     analyze_cell,
     analyze_grid,
+    detection_params_version,
     parse_grid,
     process_image,
     visualize_detection,
 )
+from .image_loader import ImageSource, load_image
 
 __all__ = [
+    'cell_rects',
+    'detect_grid',
     'detect_grid_by_color',
     'extract_cells',
+    'scale_grid_info',
     'analyze_cell',
     'analyze_grid',
+    'detection_params_version',
     'parse_grid',
     'process_image',
     'visualize_detection',
+    'ImageSource',
+    'load_image',
 ]
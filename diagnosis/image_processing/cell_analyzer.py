@@ -2,15 +2,36 @@
 Cell analysis module for detecting circle color and size.
 
 Detection logic:
+- Label every pixel with its matching colors in one LUT pass
 - Check cell CENTER for color presence (not whole cell)
 - Size 1-5 based on inscribed circle diameter via distance transform
 - diameter_ratio = 2 * max_dt_near_center / cell_width
 - None = empty cell (no color at center)
 """
+import json
+import os
+import time
+from functools import lru_cache
+
 import cv2
 import numpy as np
 
-from .grid_detector import detect_grid_by_color, extract_cells
+from ..caching import ResultCache, content_key
+from ..metrics import (
+    GRID_DETECTION_TIER_SECONDS,
+    GRID_DETECTIONS,
+    PARSE_GRID_SECONDS,
+    PARSE_GRID_STAGE_SECONDS,
+)
+from ..timing import collect, log_timings, stage
+from . import grid_detector, image_loader
+from .grid_detector import (
+    DETECTION_MAX_SIDE,
+    cell_rects,
+    detect_grid,
+    scale_grid_info,
+)
+from .image_loader import ImageSource, load_image
 
 
 # Color ranges in HSV
@@ -39,9 +60,18 @@ COLOR_RANGES = {
     }
 }
 
+# Color order used for bit positions in the label image
+COLOR_NAMES = tuple(COLOR_RANGES)
+
 # Center region size (ratio of cell size to check for color)
 CENTER_REGION_RATIO = 0.4
 
+# Minimum colored fraction of the center region to count as a dot
+MIN_CENTER_RATIO = 0.2
+
+# How analyze_grid counts center pixels: 'integral' or 'histogram'
+CENTER_STATS_MODE = 'histogram'
+
 # Minimum saturation for center color detection (excludes gray/white)
 MIN_SATURATION = 80
 
@@ -59,6 +89,31 @@ SIZE_THRESHOLDS = {
 # Morphological kernel for noise cleanup in color mask
 MORPH_KERNEL_SIZE = 3
 
+# Padding (in cell widths) around a color's cells for its distance
+# transform window; covers the largest circle plus morphology edges
+DT_WINDOW_MARGIN = 2.0
+
+# Padding (in cell widths) kept around the grid when cropping to it
+GRID_ROI_MARGIN = 2.0
+
+# Pyramid mode: detect the grid on a downscaled image and size circles
+# on a grid crop halved while cells stay at least ANALYSIS_CELL_SIZE px
+# wide (1 px of distance-transform error stays well under the gaps
+# between SIZE_THRESHOLDS)
+PYRAMID_MODE = True
+ANALYSIS_CELL_SIZE = 64
+
+# parse_grid results cached by image content and detection parameters.
+# Bump GRID_CACHE_VERSION when detection logic changes without any
+# parameter changing. GRID_CACHE_DIR enables the on-disk tier.
+GRID_CACHE_VERSION = 4
+GRID_CACHE_SIZE = int(os.environ.get('GRID_CACHE_SIZE', '256'))
+_grid_cache = ResultCache(
+    'parse_grid',
+    max_entries=GRID_CACHE_SIZE,
+    directory=os.environ.get('GRID_CACHE_DIR') or None,
+)
+
 
 def _get_color_mask(hsv_image: np.ndarray, color_name: str) -> np.ndarray:
     """Get binary mask for a specific color with saturation filtering."""
@@ -78,6 +133,177 @@ def _get_color_mask(hsv_image: np.ndarray, color_name: str) -> np.ndarray:
     return cv2.bitwise_and(color_mask, saturation_mask.astype(np.uint8) * 255)
 
 
+def _color_boxes(color_name: str) -> list[tuple[np.ndarray, np.ndarray]]:
+    """Return the (lower, upper) HSV boxes that make up a color range."""
+    ranges = COLOR_RANGES[color_name]
+    if color_name == 'RED':
+        return [
+            (ranges['lower1'], ranges['upper1']),
+            (ranges['lower2'], ranges['upper2']),
+        ]
+    return [(ranges['lower'], ranges['upper'])]
+
+
+@lru_cache(maxsize=None)
+def _build_label_luts(min_saturation: int) -> tuple:
+    """Build lookup tables that label pixels against every color range.
+
+    Each HSV range is a box, so membership splits into independent hue,
+    saturation and value tests. Every box gets one bit in three
+    256-entry tables; a fourth table folds box bits into color bits
+    (RED spans two hue boxes).
+
+    Returns:
+        Tuple of (hue_lut, sat_lut, val_lut, fold_lut).
+    """
+    luts = [np.zeros(256, np.uint8) for _ in range(3)]
+    box_colors = []
+
+    for color_idx, color_name in enumerate(COLOR_NAMES):
+        for lower, upper in _color_boxes(color_name):
+            flag = 1 << len(box_colors)
+            lows = [int(lower[0]), max(int(lower[1]), min_saturation),
+                    int(lower[2])]
+            for lut, lo, hi in zip(luts, lows, upper):
+                lut[lo:int(hi) + 1] |= flag
+            box_colors.append(color_idx)
+
+    fold_lut = np.zeros(256, np.uint8)
+    for value in range(1 << len(box_colors)):
+        for box_idx, color_idx in enumerate(box_colors):
+            if value & (1 << box_idx):
+                fold_lut[value] |= 1 << color_idx
+
+    return luts[0], luts[1], luts[2], fold_lut
+
+
+# Row v holds the per-color membership of label value v
+_LABEL_COLOR_TABLE = (
+    (np.arange(1 << len(COLOR_NAMES))[:, None]
+     >> np.arange(len(COLOR_NAMES))) & 1
+)
+
+
+def _label_colors(
+    hsv_image: np.ndarray,
+    min_saturation: int = MIN_SATURATION,
+) -> np.ndarray:
+    """Label every pixel with the colors whose HSV range it falls in.
+
+    Bit i of the result is set when the pixel matches COLOR_NAMES[i].
+    Ranges overlap at their edges (hue 80-85 is GREEN and CYAN), so a
+    pixel can carry two bits, just as separate inRange masks would
+    count it for both colors.
+    """
+    hue_lut, sat_lut, val_lut, fold_lut = _build_label_luts(min_saturation)
+    hue, sat, val = cv2.split(hsv_image)
+    boxes = cv2.bitwise_and(cv2.LUT(hue, hue_lut), cv2.LUT(sat, sat_lut))
+    boxes = cv2.bitwise_and(boxes, cv2.LUT(val, val_lut))
+    return cv2.LUT(boxes, fold_lut)
+
+
+def _center_rect(rect: tuple) -> tuple:
+    """Shrink a cell rect to its center region (CENTER_REGION_RATIO)."""
+    x1, y1, x2, y2 = rect
+    margin_h = int((y2 - y1) * (1 - CENTER_REGION_RATIO) / 2)
+    margin_w = int((x2 - x1) * (1 - CENTER_REGION_RATIO) / 2)
+    return (x1 + margin_w, y1 + margin_h, x2 - margin_w, y2 - margin_h)
+
+
+def _center_color_counts(
+    labels: np.ndarray,
+    rects: list,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Count pixels of each color inside each rect of a label image.
+
+    Returns:
+        Tuple of (counts, areas): counts is (len(rects), len(COLOR_NAMES)),
+        areas holds the pixel count of each rect.
+    """
+    n_labels = len(_LABEL_COLOR_TABLE)
+    counts = np.zeros((len(rects), len(COLOR_NAMES)), np.int64)
+    areas = np.zeros(len(rects), np.int64)
+
+    for i, (x1, y1, x2, y2) in enumerate(rects):
+        region = labels[y1:y2, x1:x2]
+        areas[i] = region.size
+        if region.size == 0:
+            continue
+        hist = np.bincount(region.ravel(), minlength=n_labels)
+        counts[i] = hist @ _LABEL_COLOR_TABLE
+
+    return counts, areas
+
+
+def _integral_color_counts(
+    labels: np.ndarray,
+    rects: list,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Count pixels of each color inside each rect via integral images.
+
+    Builds one integral image per color over the bounding box of all
+    rects, then reads every rect with four lookups per color. Same
+    result as _center_color_counts in a single NumPy expression.
+
+    Returns:
+        Tuple of (counts, areas): counts is (len(rects), len(COLOR_NAMES)),
+        areas holds the pixel count of each rect.
+    """
+    boxes = np.array(rects, dtype=np.int64).reshape(-1, 4)
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2 = np.maximum(boxes[:, 2], x1)
+    y2 = np.maximum(boxes[:, 3], y1)
+    areas = (x2 - x1) * (y2 - y1)
+    if len(boxes) == 0:
+        return np.zeros((0, len(COLOR_NAMES)), np.int64), areas
+
+    # Restrict the integrals to the area covered by the rects
+    ox, oy = int(x1.min()), int(y1.min())
+    region = labels[oy:int(y2.max()), ox:int(x2.max())]
+    x1, x2, y1, y2 = x1 - ox, x2 - ox, y1 - oy, y2 - oy
+
+    # Integral of (label & flag) counts pixels scaled by the flag value
+    flags = 1 << np.arange(len(COLOR_NAMES))
+    integrals = np.stack([
+        cv2.integral(cv2.bitwise_and(region, int(flag))) for flag in flags
+    ])
+    counts = (
+        integrals[:, y2, x2] - integrals[:, y1, x2]
+        - integrals[:, y2, x1] + integrals[:, y1, x1]
+    )
+    return (counts.T // flags).astype(np.int64), areas
+
+
+_CENTER_COUNTERS = {
+    'histogram': _center_color_counts,
+    'integral': _integral_color_counts,
+}
+
+
+def _resolve_center_colors(
+    counts: np.ndarray,
+    areas: np.ndarray,
+) -> tuple[list, np.ndarray]:
+    """Pick the dominant color per region from color pixel counts.
+
+    Ties go to the earlier color in COLOR_NAMES. Regions below
+    MIN_CENTER_RATIO resolve to (None, 0).
+
+    Returns:
+        Tuple of (colors, ratios) with one entry per region.
+    """
+    ratios = counts / np.maximum(areas, 1)[:, None]
+    best = np.argmax(ratios, axis=1)
+    best_ratios = ratios[np.arange(len(ratios)), best]
+
+    # Need significant color presence at center (>20%)
+    found = best_ratios >= MIN_CENTER_RATIO
+    colors = [
+        COLOR_NAMES[b] if ok else None for b, ok in zip(best, found)
+    ]
+    return colors, np.where(found, best_ratios, 0.0)
+
+
 def _detect_color_at_center(cell_image: np.ndarray) -> tuple:
     """
     Detect color at the center region of a cell.
@@ -89,35 +315,35 @@ def _detect_color_at_center(cell_image: np.ndarray) -> tuple:
         return None, 0
 
     h, w = cell_image.shape[:2]
-
-    # Define center region
-    margin_h = int(h * (1 - CENTER_REGION_RATIO) / 2)
-    margin_w = int(w * (1 - CENTER_REGION_RATIO) / 2)
-
-    center_region = cell_image[margin_h:h-margin_h, margin_w:w-margin_w]
+    x1, y1, x2, y2 = _center_rect((0, 0, w, h))
+    center_region = cell_image[y1:y2, x1:x2]
     if center_region.size == 0:
         return None, 0
 
-    hsv_center = cv2.cvtColor(center_region, cv2.COLOR_BGR2HSV)
-    center_area = center_region.shape[0] * center_region.shape[1]
+    labels = _label_colors(cv2.cvtColor(center_region, cv2.COLOR_BGR2HSV))
+    counts, areas = _center_color_counts(
+        labels, [(0, 0, labels.shape[1], labels.shape[0])],
+    )
+    colors, ratios = _resolve_center_colors(counts, areas)
 
-    best_color = None
-    best_ratio = 0
+    if colors[0] is None:
+        return None, 0
+    return colors[0], float(ratios[0])
 
-    for color_name in COLOR_RANGES:
-        mask = _get_color_mask(hsv_center, color_name)
-        colored_pixels = cv2.countNonZero(mask)
-        ratio = colored_pixels / center_area
 
-        if ratio > best_ratio:
-            best_ratio = ratio
-            best_color = color_name
+def _label_mask(labels: np.ndarray, color_name: str) -> np.ndarray:
+    """Extract a 0/255 mask for one color from a label image."""
+    flag = 1 << COLOR_NAMES.index(color_name)
+    return cv2.compare(cv2.bitwise_and(labels, flag), 0, cv2.CMP_GT)
 
-    # Need significant color presence at center (>20%)
-    if best_ratio < 0.2:
-        return None, 0
 
-    return best_color, best_ratio
+def _clean_mask(mask: np.ndarray) -> np.ndarray:
+    """Remove speckle noise and fill pinholes with open/close."""
+    kernel = cv2.getStructuringElement(
+        cv2.MORPH_ELLIPSE, (MORPH_KERNEL_SIZE, MORPH_KERNEL_SIZE),
+    )
+    cleaned = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+    return cv2.morphologyEx(cleaned, cv2.MORPH_CLOSE, kernel)
 
 
 def _get_full_color_mask(
@@ -130,24 +356,51 @@ def _get_full_color_mask(
     circle edges where color fades to white.
     """
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-    ranges = COLOR_RANGES[color_name]
-    saturation_mask = hsv[:, :, 1] >= DT_MIN_SATURATION
+    labels = _label_colors(hsv, DT_MIN_SATURATION)
+    return _clean_mask(_label_mask(labels, color_name))
 
-    if color_name == 'RED':
-        mask1 = cv2.inRange(hsv, ranges['lower1'], ranges['upper1'])
-        mask2 = cv2.inRange(hsv, ranges['lower2'], ranges['upper2'])
-        color_mask = cv2.bitwise_or(mask1, mask2)
-    else:
-        color_mask = cv2.inRange(hsv, ranges['lower'], ranges['upper'])
 
-    mask = cv2.bitwise_and(
-        color_mask, saturation_mask.astype(np.uint8) * 255,
-    )
-    kernel = cv2.getStructuringElement(
-        cv2.MORPH_ELLIPSE, (MORPH_KERNEL_SIZE, MORPH_KERNEL_SIZE),
-    )
-    cleaned = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-    return cv2.morphologyEx(cleaned, cv2.MORPH_CLOSE, kernel)
+def _color_distance_maps(
+    dt_labels: np.ndarray,
+    cell_colors: list,
+    rects: list,
+    cell_w: float,
+) -> dict[str, tuple[np.ndarray, int, int]]:
+    """Distance-transform each color only around the cells that hold it.
+
+    Masks come from a label image built once with DT_MIN_SATURATION,
+    and each transform covers the bounding box of that color's cells
+    padded by DT_WINDOW_MARGIN cells. Beyond the image border the
+    transform treats pixels as foreground, so inside the window the
+    distances match a full-image transform.
+
+    Args:
+        dt_labels: Label image from _label_colors at DT_MIN_SATURATION
+        cell_colors: Color name (or None) per cell
+        rects: Cell bounds (x1, y1, x2, y2) per cell
+        cell_w: Cell width in pixels
+
+    Returns:
+        Mapping color -> (dist_map, x0, y0), where dist_map covers the
+        image from offset (x0, y0).
+    """
+    margin = int(np.ceil(DT_WINDOW_MARGIN * cell_w))
+    img_h, img_w = dt_labels.shape[:2]
+    maps = {}
+
+    for color in dict.fromkeys(c for c in cell_colors if c is not None):
+        boxes = np.array([
+            rect for rect, c in zip(rects, cell_colors) if c == color
+        ])
+        x0 = max(0, int(boxes[:, 0].min()) - margin)
+        y0 = max(0, int(boxes[:, 1].min()) - margin)
+        x1 = min(img_w, int(boxes[:, 2].max()) + margin)
+        y1 = min(img_h, int(boxes[:, 3].max()) + margin)
+
+        mask = _clean_mask(_label_mask(dt_labels[y0:y1, x0:x1], color))
+        maps[color] = (cv2.distanceTransform(mask, cv2.DIST_L2, 5), x0, y0)
+
+    return maps
 
 
 def _measure_diameter_ratio(
@@ -219,31 +472,52 @@ def analyze_cell(cell_image: np.ndarray) -> dict:
     }
 
 
-def analyze_grid(image: np.ndarray, grid_info: dict) -> dict:
+def analyze_grid(
+    image: np.ndarray,
+    grid_info: dict,
+    center_stats: str = CENTER_STATS_MODE,
+) -> dict:
     """Analyze all 81 cells using distance-transform sizing.
 
-    Extracts cells for color detection, then measures circle diameter
-    via distance transform on the full image for each colored cell.
+    Converts to HSV once and reads each cell's center color from a
+    label image, then measures circle diameter via distance transform
+    around the colored cells, one window per color present.
 
     Args:
         image: Full BGR image
         grid_info: Grid detection result with grid_lines_h/v
+        center_stats: Center pixel counting, 'integral' (all cells in
+            one lookup) or 'histogram' (per-cell bincount)
 
     Returns:
         Dictionary with grid_color, grid_size, cell_details.
     """
-    cells = extract_cells(image, grid_info)
+    if center_stats not in _CENTER_COUNTERS:
+        raise ValueError(f'Unknown center_stats mode: {center_stats}')
+
     h_lines = grid_info['grid_lines_h']
     v_lines = grid_info['grid_lines_v']
     cell_w = float(v_lines[1] - v_lines[0])
 
+    with stage('hsv'):
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    rects = cell_rects(image.shape, grid_info)
+    count_colors = _CENTER_COUNTERS[center_stats]
+    with stage('cell_color'):
+        colors, center_ratios = _resolve_center_colors(*count_colors(
+            _label_colors(hsv), [_center_rect(rect) for rect in rects],
+        ))
+    with stage('distance_transform'):
+        dist_maps = _color_distance_maps(
+            _label_colors(hsv, DT_MIN_SATURATION), colors, rects, cell_w,
+        )
+
     grid_color = []
     grid_size = []
     cell_details = []
-    dt_cache: dict[str, np.ndarray] = {}
 
-    for i, cell in enumerate(cells):
-        color, center_ratio = _detect_color_at_center(cell)
+    for i, color in enumerate(colors):
+        center_ratio = float(center_ratios[i])
 
         if color is None:
             grid_color.append(None)
@@ -260,19 +534,15 @@ def analyze_grid(image: np.ndarray, grid_info: dict) -> dict:
             })
             continue
 
-        if color not in dt_cache:
-            mask = _get_full_color_mask(image, color)
-            dt_cache[color] = cv2.distanceTransform(
-                mask, cv2.DIST_L2, 5
-            )
-
         row, col = i // 9, i % 9
         cx = (v_lines[col] + v_lines[col + 1]) / 2.0
         cy = (h_lines[row] + h_lines[row + 1]) / 2.0
 
-        diameter_ratio = _measure_diameter_ratio(
-            dt_cache[color], cx, cy, cell_w
-        )
+        dist_map, x0, y0 = dist_maps[color]
+        with stage('sizing'):
+            diameter_ratio = _measure_diameter_ratio(
+                dist_map, cx - x0, cy - y0, cell_w
+            )
 
         if diameter_ratio > SIZE_THRESHOLDS['t4']:
             size = 5
@@ -324,7 +594,16 @@ def visualize_detection(
     v_lines = grid_info['grid_lines_v']
     font = cv2.FONT_HERSHEY_SIMPLEX
 
-    dt_cache: dict[str, np.ndarray] = {}
+    cell_colors = [None] * 81
+    for detail in analysis['cell_details']:
+        cell_colors[detail['index']] = detail['color']
+    dt_labels = _label_colors(
+        cv2.cvtColor(image, cv2.COLOR_BGR2HSV), DT_MIN_SATURATION,
+    )
+    dist_maps = _color_distance_maps(
+        dt_labels, cell_colors, cell_rects(image.shape, grid_info),
+        float(v_lines[1] - v_lines[0]),
+    )
 
     # Draw grid lines (thin blue)
     for y in h_lines:
@@ -365,13 +644,8 @@ def visualize_detection(
             continue
 
         # Compute DT peak and radius
-        if color not in dt_cache:
-            mask = _get_full_color_mask(image, color)
-            dt_cache[color] = cv2.distanceTransform(
-                mask, cv2.DIST_L2, 5,
-            )
-
-        cell_dt = dt_cache[color][y1:y2, x1:x2]
+        dist_map, ox, oy = dist_maps[color]
+        cell_dt = dist_map[y1 - oy:y2 - oy, x1 - ox:x2 - ox]
         if cell_dt.size == 0:
             continue
         peak_idx = np.unravel_index(
@@ -436,35 +710,223 @@ def _to_native(obj):
     return obj
 
 
-def parse_grid(image_path: str) -> dict:
+def _crop_to_grid(
+    image: np.ndarray,
+    grid_info: dict,
+) -> tuple[np.ndarray, dict, tuple[int, int]]:
+    """Crop the image to the grid bounds padded by GRID_ROI_MARGIN cells.
+
+    The crop is a view, not a copy. Grid lines in the returned
+    grid_info are shifted into crop coordinates; add the offset to map
+    them back to the original image.
+
+    Returns:
+        Tuple of (roi, roi_grid_info, (x0, y0)).
+    """
+    h_lines = grid_info['grid_lines_h']
+    v_lines = grid_info['grid_lines_v']
+    margin = int(np.ceil(GRID_ROI_MARGIN * (v_lines[1] - v_lines[0])))
+
+    x0 = max(0, int(np.floor(min(v_lines))) - margin)
+    y0 = max(0, int(np.floor(min(h_lines))) - margin)
+    x1 = min(image.shape[1], int(np.ceil(max(v_lines))) + margin)
+    y1 = min(image.shape[0], int(np.ceil(max(h_lines))) + margin)
+
+    roi_info = {
+        **grid_info,
+        'grid_lines_h': [line - y0 for line in h_lines],
+        'grid_lines_v': [line - x0 for line in v_lines],
+    }
+    return image[y0:y1, x0:x1], roi_info, (x0, y0)
+
+
+def _downscale_for_analysis(
+    roi: np.ndarray,
+    roi_info: dict,
+) -> tuple[np.ndarray, dict, int]:
+    """Halve the grid crop while cells stay >= ANALYSIS_CELL_SIZE wide.
+
+    Returns:
+        Tuple of (roi, roi_grid_info, scale) where scale is the factor
+        the crop was reduced by (1 if unchanged).
+    """
+    v_lines = roi_info['grid_lines_v']
+    cell_w = (v_lines[-1] - v_lines[0]) / 9
+
+    scale = 1
+    while cell_w / (scale * 2) >= ANALYSIS_CELL_SIZE:
+        scale *= 2
+    if scale == 1:
+        return roi, roi_info, 1
+
+    small = cv2.resize(
+        roi, None, fx=1 / scale, fy=1 / scale,
+        interpolation=cv2.INTER_AREA,
+    )
+    return small, scale_grid_info(roi_info, 1 / scale), scale
+
+
+def detection_params_version(pyramid: bool = PYRAMID_MODE) -> str:
+    """Fingerprint of every parameter that affects parse_grid output.
+
+    Read at call time, so changing a threshold changes the version and
+    old cache entries stop matching.
+    """
+    params = {
+        'version': GRID_CACHE_VERSION,
+        'color_ranges': COLOR_RANGES,
+        'center_region_ratio': CENTER_REGION_RATIO,
+        'min_center_ratio': MIN_CENTER_RATIO,
+        'min_saturation': MIN_SATURATION,
+        'dt_min_saturation': DT_MIN_SATURATION,
+        'size_thresholds': SIZE_THRESHOLDS,
+        'morph_kernel_size': MORPH_KERNEL_SIZE,
+        'dt_window_margin': DT_WINDOW_MARGIN,
+        'grid_roi_margin': GRID_ROI_MARGIN,
+        'pyramid': pyramid,
+        'analysis_cell_size': ANALYSIS_CELL_SIZE,
+        'detection_max_side': grid_detector.DETECTION_MAX_SIDE,
+        'min_decode_side': image_loader.MIN_DECODE_SIDE,
+    }
+    return content_key(json.dumps(_to_native(params), sort_keys=True))[:16]
+
+
+def _source_name(image: str | ImageSource) -> str:
+    """Display name of an image path or source for error messages."""
+    return image.name if isinstance(image, ImageSource) else image
+
+
+def parse_grid(
+    image_path: str | ImageSource,
+    pyramid: bool = PYRAMID_MODE,
+    use_cache: bool = True,
+) -> dict:
     """
     Parse a grid image and return grid_color and grid_size arrays.
 
+    Cells are analyzed on a padded crop of the detected grid. In
+    pyramid mode large JPEGs are decoded, detected and sized at reduced
+    resolution; grid_info stays in original pixels and reports
+    decode_scale, detection_scale and analysis_scale.
+
+    Successful results are cached by a hash of the image bytes plus
+    detection_params_version(), so a repeat image skips all processing.
+
+    grid_info['detection_tier'] names the detection tier that found the
+    grid, and 'detection_attempts' lists every tier tried with its cost
+    in ms (also when detection failed).
+
+    Unless PIPELINE_TIMING is off, the result has 'timings' with the
+    cache outcome, total_ms and per-stage milliseconds of this call,
+    which is also logged as one structured line (see diagnosis.timing).
+
     Args:
-        image_path: Path to the input image
+        image_path: Path to the input image, or an in-memory ImageSource
+        pyramid: Enable reduced-resolution decoding, detection and sizing
+        use_cache: Look up and store the result in the parse_grid cache
 
     Returns:
         Dictionary with grid_color (81 values), grid_size (1-5), success flag.
     """
-    image = cv2.imread(image_path)
+    start = time.perf_counter()
+    with collect() as timings:
+        result, cache_status = _parse_grid_cached(
+            image_path, pyramid, use_cache,
+        )
+    PARSE_GRID_SECONDS.observe(
+        time.perf_counter() - start, cache=cache_status,
+    )
+    if cache_status != 'hit' and 'detection_attempts' in result:
+        GRID_DETECTIONS.inc(
+            tier=result.get('grid_info', {}).get('detection_tier', 'failed'),
+        )
+        for attempt in result.get('detection_attempts', []):
+            GRID_DETECTION_TIER_SECONDS.observe(
+                attempt['ms'] / 1000, tier=attempt['tier'],
+            )
+
+    if timings is not None:
+        for name, ms in timings.stages.items():
+            PARSE_GRID_STAGE_SECONDS.observe(ms / 1000, stage=name)
+        timings.tags['cache'] = cache_status
+        result['timings'] = timings.as_dict()
+        log_timings(
+            'parse_grid', timings,
+            image=_source_name(image_path),
+            success=result['success'],
+            detection_tier=result.get('grid_info', {}).get('detection_tier'),
+            detection_attempts=result.get('detection_attempts'),
+        )
+    return result
+
+
+def _parse_grid_cached(
+    image_path: str | ImageSource,
+    pyramid: bool,
+    use_cache: bool,
+) -> tuple[dict, str]:
+    """Run parse_grid through the cache; returns (result, 'hit'/'miss'/'off')."""
+    if not use_cache:
+        return _parse_grid_uncached(image_path, pyramid), 'off'
+
+    if not isinstance(image_path, ImageSource):
+        try:
+            image_path = ImageSource.from_path(image_path)
+        except OSError:
+            return _parse_grid_uncached(image_path, pyramid), 'off'
+
+    with stage('cache_lookup'):
+        cache_key = content_key(
+            image_path.data, detection_params_version(pyramid),
+        )
+        cached = _grid_cache.get(cache_key)
+    if cached is not None:
+        return cached, 'hit'
+
+    result = _parse_grid_uncached(image_path, pyramid)
+    if result['success']:
+        with stage('cache_store'):
+            _grid_cache.set(cache_key, result)
+    return result, 'miss'
+
+
+def _parse_grid_uncached(
+    image_path: str | ImageSource,
+    pyramid: bool,
+) -> dict:
+    """Run the full parse_grid pipeline without the cache."""
+    image, decode_scale = load_image(image_path, reduce=pyramid)
     if image is None:
         return {
             'success': False,
-            'error': f'Could not load image: {image_path}',
+            'error': f'Could not load image: {_source_name(image_path)}',
             'grid_color': [None] * 81,
             'grid_size': [0] * 81
         }
 
-    grid_info = detect_grid_by_color(image)
+    attempts = []
+    grid_info = detect_grid(
+        image, max_side=DETECTION_MAX_SIDE if pyramid else None,
+        attempts=attempts,
+    )
     if grid_info is None:
         return {
             'success': False,
             'error': 'Could not detect grid in image',
             'grid_color': [None] * 81,
-            'grid_size': [0] * 81
+            'grid_size': [0] * 81,
+            'detection_attempts': attempts,
         }
 
-    analysis = analyze_grid(image, grid_info)
+    with stage('crop'):
+        roi, roi_info, _ = _crop_to_grid(image, grid_info)
+        analysis_scale = 1
+        if pyramid:
+            roi, roi_info, analysis_scale = _downscale_for_analysis(
+                roi, roi_info,
+            )
+    analysis = analyze_grid(roi, roi_info)
+    grid_info = scale_grid_info(grid_info, decode_scale)
 
     return _to_native({
         'success': True,
@@ -473,31 +935,65 @@ def parse_grid(image_path: str) -> dict:
         'cell_details': analysis['cell_details'],
         'grid_info': {
             'bounds': grid_info['bounds'],
-            'cell_size': grid_info['cell_size']
-        }
+            'cell_size': grid_info['cell_size'],
+            'decode_scale': decode_scale,
+            'detection_scale': grid_info['detection_scale'],
+            'detection_tier': grid_info['detection_tier'],
+            'analysis_scale': analysis_scale,
+        },
+        'detection_attempts': attempts,
     })
 
 
-def process_image(image_path: str) -> dict:
+def process_image(
+    image_path: str | ImageSource,
+    pyramid: bool = PYRAMID_MODE,
+) -> dict:
     """
     Complete processing pipeline for a single image.
 
+    Analysis and visualization run on a padded crop of the grid, so
+    their cost follows grid area rather than screenshot resolution.
+    The overlay is drawn at decoded resolution; grid_info is in
+    original pixels.
+
     Args:
-        image_path: Path to the input image
+        image_path: Path to the input image, or an in-memory ImageSource
+        pyramid: Enable reduced-resolution decoding, detection and sizing
 
     Returns:
         Dictionary with all detection results
     """
-    image = cv2.imread(image_path)
+    image, decode_scale = load_image(image_path, reduce=pyramid)
     if image is None:
-        return {'error': f'Could not load image: {image_path}'}
+        return {
+            'error': f'Could not load image: {_source_name(image_path)}',
+        }
 
-    grid_info = detect_grid_by_color(image)
+    grid_info = detect_grid(
+        image, max_side=DETECTION_MAX_SIDE if pyramid else None,
+    )
     if grid_info is None:
         return {'error': 'Could not detect grid in image'}
 
-    analysis = analyze_grid(image, grid_info)
-    viz_image = visualize_detection(image, grid_info, analysis)
+    roi, roi_info, (x0, y0) = _crop_to_grid(image, grid_info)
+    analysis_roi, analysis_info, analysis_scale = roi, roi_info, 1
+    if pyramid:
+        analysis_roi, analysis_info, analysis_scale = (
+            _downscale_for_analysis(roi, roi_info)
+        )
+    analysis = analyze_grid(analysis_roi, analysis_info)
+    grid_info['analysis_scale'] = analysis_scale
+
+    # Draw on the grid region only and paste it into the full frame
+    with stage('visualize'):
+        viz_image = image.copy()
+        viz_image[y0:y0 + roi.shape[0], x0:x0 + roi.shape[1]] = (
+            visualize_detection(roi, roi_info, analysis)
+        )
+
+    grid_info = scale_grid_info(grid_info, decode_scale)
+    grid_info['decode_scale'] = decode_scale
 
     return {
         'grid_info': grid_info,
@@ -505,5 +1001,3 @@ def process_image(image_path: str) -> dict:
         'visualization': viz_image,
         'image_shape': image.shape,
     }
-
-
@@ -3,21 +3,28 @@ Grid detection module using OpenCV.
 
 Detects 9x9 grid in training result images and extracts cell regions.
 Strategy: Find the outer boundary of the grid first, then divide into 9x9 cells.
+
+Detection tries three tiers in turn (DETECTION_TIERS): the gray grid
+region (color), Hough lines (lines) and the largest square contour
+(contour). The result's 'detection_tier' records which one found the
+grid and 'detection_attempts' what each tier tried cost.
 """
+import time
+
 import cv2
 import numpy as np
 from typing import Optional
 
+from ..timing import stage
 
-def detect_grid_by_color(image: np.ndarray) -> Optional[dict]:
-    """
-    Detect 9x9 grid by finding the gray grid border region.
 
-    Strategy:
-    1. Detect gray pixels (grid lines are gray)
-    2. Find the bounding rectangle of the grid region
-    3. Divide into 9x9 cells
-    """
+# Images whose longest side exceeds this are detected on a downscaled
+# copy (by a power of two), then grid lines are refined at full size
+DETECTION_MAX_SIDE = 1600
+
+
+def _get_gray_mask(image: np.ndarray) -> np.ndarray:
+    """Mask of gray grid-line pixels, closed to connect the lines."""
     hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
 
     # Detect gray regions (low saturation, medium value)
@@ -28,13 +35,60 @@ def detect_grid_by_color(image: np.ndarray) -> Optional[dict]:
 
     # Morphological operations to connect grid lines
     kernel = np.ones((3, 3), np.uint8)
-    gray_mask = cv2.morphologyEx(gray_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    return cv2.morphologyEx(gray_mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+
+def detect_grid_by_color(
+    image: np.ndarray,
+    attempts: Optional[list] = None,
+) -> Optional[dict]:
+    """
+    Detect the 9x9 grid, trying each of DETECTION_TIERS until one succeeds.
+
+    Every tier tried is recorded as {'tier', 'ms', 'found'}, in the
+    result's 'detection_attempts' and, if given, appended to attempts,
+    which also keeps them when no tier finds the grid.
+
+    Args:
+        image: BGR image
+        attempts: Optional list to append the attempted tiers to
+    """
+    if attempts is None:
+        attempts = []
+
+    for tier, detect in DETECTION_TIERS:
+        with stage(f'detect_{tier}'):
+            start = time.perf_counter()
+            grid_info = detect(image)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+        attempts.append({
+            'tier': tier,
+            'ms': round(elapsed_ms, 3),
+            'found': grid_info is not None,
+        })
+        if grid_info is not None:
+            grid_info['detection_tier'] = tier
+            grid_info['detection_attempts'] = attempts
+            return grid_info
+    return None
+
+
+def _detect_grid_by_gray_region(image: np.ndarray) -> Optional[dict]:
+    """
+    Detect 9x9 grid by finding the gray grid border region.
+
+    Strategy:
+    1. Detect gray pixels (grid lines are gray)
+    2. Find the bounding rectangle of the grid region
+    3. Divide into 9x9 cells
+    """
+    gray_mask = _get_gray_mask(image)
 
     # Find contours of gray regions
     contours, _ = cv2.findContours(gray_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
     if not contours:
-        return _detect_grid_by_lines(image)
+        return None
 
     # Find the largest square-ish contour (the grid)
     best_contour = None
@@ -58,7 +112,7 @@ def detect_grid_by_color(image: np.ndarray) -> Optional[dict]:
                 best_contour = (x, y, w, h)
 
     if best_contour is None:
-        return _detect_grid_by_lines(image)
+        return None
 
     x, y, w, h = best_contour
 
@@ -91,7 +145,116 @@ def detect_grid_by_color(image: np.ndarray) -> Optional[dict]:
         'bounds': (x, y, w, h),
         'cell_size': (cell_w, cell_h),
         'grid_lines_h': h_grid,
-        'grid_lines_v': v_grid
+        'grid_lines_v': v_grid,
+    }
+
+
+def detection_image(
+    image: np.ndarray,
+    max_side: Optional[int] = DETECTION_MAX_SIDE,
+) -> tuple[np.ndarray, int]:
+    """
+    The image detect_grid runs the detection tiers on.
+
+    Returns:
+        Tuple of (image halved until its longest side fits max_side,
+        downscale factor); the image itself and 1 if it already fits or
+        max_side is None.
+    """
+    scale = 1
+    if max_side:
+        while max(image.shape[:2]) / scale > max_side:
+            scale *= 2
+    if scale == 1:
+        return image, 1
+
+    with stage('detect_resize'):
+        small = cv2.resize(
+            image, None, fx=1 / scale, fy=1 / scale,
+            interpolation=cv2.INTER_AREA,
+        )
+    return small, scale
+
+
+def detect_grid(
+    image: np.ndarray,
+    max_side: Optional[int] = DETECTION_MAX_SIDE,
+    attempts: Optional[list] = None,
+) -> Optional[dict]:
+    """
+    Detect the grid on a downscaled copy when the image is large.
+
+    The image is halved until its longest side fits max_side, the grid
+    is detected there, and its lines are re-located on the full-size
+    gray mask around the scaled-up bounds. Coordinates in the result
+    are always full-size pixels; 'detection_scale' records the factor.
+
+    Args:
+        image: Full BGR image
+        max_side: Longest side to detect at, or None to disable
+        attempts: Optional list to append the attempted tiers to (see
+            detect_grid_by_color)
+    """
+    small, scale = detection_image(image, max_side)
+    if scale == 1:
+        grid_info = detect_grid_by_color(image, attempts)
+        if grid_info is not None:
+            grid_info['detection_scale'] = 1
+        return grid_info
+
+    coarse = detect_grid_by_color(small, attempts)
+    if coarse is None:
+        return None
+
+    grid_info = scale_grid_info(coarse, scale)
+    x, y, w, h = grid_info['bounds']
+    size = min(w, h)
+
+    # Re-locate line centers at full resolution near the coarse bounds
+    margin = int(size * 0.05)
+    x1 = max(0, x - margin)
+    y1 = max(0, y - margin)
+    x2 = min(image.shape[1], x + size + margin)
+    y2 = min(image.shape[0], y + size + margin)
+    with stage('detect_refine'):
+        h_grid, v_grid = _find_line_centers_by_projection(
+            _get_gray_mask(image[y1:y2, x1:x2]), x - x1, y - y1, size,
+        )
+
+    if h_grid is not None and v_grid is not None:
+        h_grid = [y1 + p for p in h_grid]
+        v_grid = [x1 + p for p in v_grid]
+        grid_info['grid_lines_h'] = h_grid
+        grid_info['grid_lines_v'] = v_grid
+        grid_info['cell_size'] = (
+            (v_grid[-1] - v_grid[0]) / 9,
+            (h_grid[-1] - h_grid[0]) / 9,
+        )
+        # Keep the bounds on the refined lines, not the scaled-up coarse ones
+        grid_info['bounds'] = (
+            int(v_grid[0]),
+            int(h_grid[0]),
+            int(v_grid[-1] - v_grid[0]),
+            int(h_grid[-1] - h_grid[0]),
+        )
+
+    grid_info['detection_scale'] = scale
+    return grid_info
+
+
+def scale_grid_info(grid_info: dict, factor: float) -> dict:
+    """Return a copy of grid_info with all coordinates multiplied."""
+    x, y, w, h = grid_info['bounds']
+    cell_w, cell_h = grid_info['cell_size']
+    return {
+        **grid_info,
+        'bounds': (
+            int(round(x * factor)), int(round(y * factor)),
+            int(round(w * factor)), int(round(h * factor)),
+        ),
+        'cell_size': (cell_w * factor, cell_h * factor),
+        'grid_lines_h': [p * factor for p in grid_info['grid_lines_h']],
+        'grid_lines_v': [p * factor for p in grid_info['grid_lines_v']],
     }
 
 
@@ -111,13 +274,13 @@ def _detect_grid_by_lines(image: np.ndarray) -> Optional[dict]:
     )
 
     if lines is None or len(lines) < 10:
-        return _detect_grid_by_contour(image)
+        return None
 
     h_lines = []
     v_lines = []
 
-    for line in lines:
-        x1, y1, x2, y2 = line[0]
+    # OpenCV 4 returns (N, 1, 4) and OpenCV 5 (N, 4)
+    for x1, y1, x2, y2 in lines.reshape(-1, 4):
         length = np.sqrt((x2-x1)**2 + (y2-y1)**2)
         if length < 30:
             continue
@@ -132,7 +295,7 @@ def _detect_grid_by_lines(image: np.ndarray) -> Optional[dict]:
             v_lines.append(((x1 + x2) / 2, min(y1, y2), max(y1, y2)))
 
     if len(h_lines) < 5 or len(v_lines) < 5:
-        return _detect_grid_by_contour(image)
+        return None
 
     # Cluster lines
     h_positions = _cluster_positions([l[0] for l in h_lines])
@@ -143,7 +306,7 @@ def _detect_grid_by_lines(image: np.ndarray) -> Optional[dict]:
     v_grid = _find_evenly_spaced(v_positions, 10)
 
     if h_grid is None or v_grid is None:
-        return _detect_grid_by_contour(image)
+        return None
 
     x = int(v_grid[0])
     y = int(h_grid[0])
@@ -154,7 +317,7 @@ def _detect_grid_by_lines(image: np.ndarray) -> Optional[dict]:
         'bounds': (x, y, w, h),
         'cell_size': (w / 9, h / 9),
         'grid_lines_h': h_grid,
-        'grid_lines_v': v_grid
+        'grid_lines_v': v_grid,
     }
 
 
@@ -197,10 +360,20 @@ def _detect_grid_by_contour(image: np.ndarray) -> Optional[dict]:
         'bounds': (x, y, w, h),
         'cell_size': (cell_w, cell_h),
         'grid_lines_h': [y + i * cell_h for i in range(10)],
-        'grid_lines_v': [x + i * cell_w for i in range(10)]
+        'grid_lines_v': [x + i * cell_w for i in range(10)],
     }
 
 
+# Detection tiers in the order detect_grid_by_color tries them, cheapest
+# first: the gray region is one threshold pass, lines and contour need
+# Canny (plus HoughLinesP for lines)
+DETECTION_TIERS = (
+    ('color', _detect_grid_by_gray_region),
+    ('lines', _detect_grid_by_lines),
+    ('contour', _detect_grid_by_contour),
+)
+
+
 def _find_line_centers_by_projection(
     gray_mask: np.ndarray,
     x: int,
@@ -377,13 +550,14 @@ def _find_evenly_spaced(positions: list, target: int = 10) -> Optional[list]:
     return best
 
 
-def extract_cells(image: np.ndarray, grid_info: dict) -> list:
+def cell_rects(image_shape: tuple, grid_info: dict) -> list:
     """
-    Extract individual cell images from the grid.
+    Compute the pixel bounds of every cell in the grid.
 
-    Returns list of 81 cell images in row-major order.
+    Returns list of 81 (x1, y1, x2, y2) tuples in row-major order,
+    clipped to the image and matching the crops of extract_cells.
     """
-    cells = []
+    rects = []
     h_lines = grid_info['grid_lines_h']
     v_lines = grid_info['grid_lines_v']
 
@@ -397,11 +571,22 @@ def extract_cells(image: np.ndarray, grid_info: dict) -> list:
             # Small padding to avoid grid lines
             pad = 2
             y1 = max(0, y1 + pad)
-            y2 = min(image.shape[0], y2 - pad)
+            y2 = min(image_shape[0], y2 - pad)
             x1 = max(0, x1 + pad)
-            x2 = min(image.shape[1], x2 - pad)
+            x2 = min(image_shape[1], x2 - pad)
 
-            cell = image[y1:y2, x1:x2]
-            cells.append(cell)
+            rects.append((x1, y1, x2, y2))
 
-    return cells
+    return rects
+
+
+def extract_cells(image: np.ndarray, grid_info: dict) -> list:
+    """
+    Extract individual cell images from the grid.
+
+    Returns list of 81 cell images in row-major order.
+    """
+    return [
+        image[y1:y2, x1:x2]
+        for x1, y1, x2, y2 in cell_rects(image.shape, grid_info)
+    ]
@@ -0,0 +1,186 @@
+"""
+Image loading with reduced-resolution JPEG decoding.
+
+ImageSource holds an image's encoded bytes so one read from disk (or an
+in-memory upload) can feed both the OpenCV pipeline and the AI request.
+
+Large camera photos are decoded at 1/2, 1/4 or 1/8 size directly by the
+JPEG decoder (cv2.IMREAD_REDUCED_COLOR_*), which skips most of the
+decode work and memory. The image header is read first to pick the
+largest reduction that keeps the longest side at or above
+MIN_DECODE_SIDE. Callers multiply coordinates by the returned scale to
+get back to original pixels.
+"""
+import struct
+from pathlib import Path
+from typing import Optional, Union
+
+import cv2
+import numpy as np
+
+from ..timing import timed
+from .grid_detector import DETECTION_MAX_SIDE
+
+
+# Reduced decodes never go below the size grid detection runs at
+MIN_DECODE_SIDE = DETECTION_MAX_SIDE
+
+# Bytes read to find the image size (JPEG EXIF can push SOF far back)
+HEADER_READ_SIZE = 256 * 1024
+
+REDUCED_DECODE_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+
+MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp',
+}
+
+# JPEG start-of-frame markers (excluding DHT, JPG and DAC)
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _read_jpeg_size(data: bytes) -> Optional[tuple[int, int]]:
+    """Find (width, height) in the SOF segment of a JPEG header."""
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker in (0x01, *range(0xD0, 0xD8)):
+            pos += 2
+            continue
+        (length,) = struct.unpack('>H', data[pos + 2:pos + 4])
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + length
+    return None
+
+
+def read_image_size(header: bytes) -> Optional[tuple[int, int]]:
+    """
+    Read (width, height) from the start of a JPEG or PNG file.
+
+    Returns:
+        Tuple of (width, height), or None if not found in the header.
+    """
+    if header.startswith(b'\xff\xd8'):
+        return _read_jpeg_size(header)
+    if header.startswith(b'\x89PNG\r\n\x1a\n') and len(header) >= 24:
+        return struct.unpack('>II', header[16:24])
+    return None
+
+
+def choose_decode_scale(header: bytes) -> int:
+    """
+    Pick the JPEG reduction factor for an image header.
+
+    Returns 1 for PNG (the decoder would resize after a full decode
+    anyway) and for JPEGs that are not much larger than MIN_DECODE_SIDE.
+    """
+    if not header.startswith(b'\xff\xd8'):
+        return 1
+    size = read_image_size(header)
+    if size is None:
+        return 1
+    for scale in REDUCED_DECODE_FLAGS:
+        if max(size) / scale >= MIN_DECODE_SIDE:
+            return scale
+    return 1
+
+
+class ImageSource:
+    """
+    Encoded image bytes plus a name, decoded in memory on demand.
+
+    Build from a path (read once, eagerly) or from bytes already in
+    memory. The same instance can be decoded for grid parsing and sent
+    as-is to the AI service.
+    """
+
+    def __init__(self, data: bytes, name: str = ''):
+        self.data = data
+        self.name = name
+
+    @classmethod
+    def from_path(cls, path: Union[str, Path]) -> 'ImageSource':
+        """Read an image file from disk into memory."""
+        return cls(Path(path).read_bytes(), name=str(path))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, name: str = '') -> 'ImageSource':
+        """Wrap encoded image bytes, e.g. an upload held in memory."""
+        return cls(bytes(data), name=name)
+
+    @property
+    def mime_type(self) -> str:
+        """MIME type from the name's extension, else the magic bytes."""
+        ext = Path(self.name).suffix.lower()
+        if ext in MIME_TYPES:
+            return MIME_TYPES[ext]
+        if self.data.startswith(b'\x89PNG\r\n\x1a\n'):
+            return 'image/png'
+        return 'image/jpeg'
+
+    def decode(self, reduce: bool = True) -> tuple[Optional[np.ndarray], int]:
+        """
+        Decode to a BGR image with cv2.imdecode.
+
+        Returns:
+            Tuple of (image or None, scale) as for load_image.
+        """
+        scale = 1
+        if reduce:
+            scale = choose_decode_scale(self.data[:HEADER_READ_SIZE])
+        flags = REDUCED_DECODE_FLAGS.get(scale, cv2.IMREAD_COLOR)
+        buffer = np.frombuffer(self.data, dtype=np.uint8)
+        if buffer.size == 0:
+            return None, 1
+        return cv2.imdecode(buffer, flags), scale
+
+    def __repr__(self) -> str:
+        return f'ImageSource({self.name!r}, {len(self.data)} bytes)'
+
+
+@timed('decode')
+def load_image(
+    image: Union[str, ImageSource],
+    reduce: bool = True,
+) -> tuple[Optional[np.ndarray], int]:
+    """
+    Load a BGR image, decoding large JPEGs at reduced resolution.
+
+    Args:
+        image: Path to the input image, or an ImageSource
+        reduce: Allow reduced-resolution decoding
+
+    Returns:
+        Tuple of (image or None, scale) where original pixel
+        coordinates are decoded coordinates times scale.
+    """
+    if isinstance(image, ImageSource):
+        return image.decode(reduce=reduce)
+
+    image_path = image
+    scale = 1
+    if reduce:
+        try:
+            with open(image_path, 'rb') as f:
+                scale = choose_decode_scale(f.read(HEADER_READ_SIZE))
+        except OSError:
+            return None, 1
+
+    flags = REDUCED_DECODE_FLAGS.get(scale, cv2.IMREAD_COLOR)
+    return cv2.imread(image_path, flags), scale
@@ -0,0 +1,213 @@
+"""
+Synthetic 9x9 grid images with known answers.
+
+Renders training-result screenshots like the ones in data/test_inputs:
+a light background, gray grid lines (thicker every third cell) and
+semi-transparent dots centered on cells. Dot colors come from the
+middle of each COLOR_RANGES hue band and dot diameters from the middle
+of each SIZE_THRESHOLDS band, so parse_grid should read back exactly
+the grid_color/grid_size the image was drawn from.
+
+Layout, resolution, rotation, JPEG quality and noise are configurable,
+which makes the images usable for load tests, scaling benchmarks and
+accuracy checks beyond the fixed fixtures.
+"""
+from typing import Optional, Sequence
+
+import cv2
+import numpy as np
+
+from .cell_analyzer import COLOR_RANGES, SIZE_THRESHOLDS
+
+# Geometry of a 1x screenshot (matches the data/test_inputs captures)
+BASE_WIDTH = 848
+BASE_HEIGHT = 1600
+BASE_GRID_ORIGIN = (120, 839)
+BASE_GRID_SIZE = 601
+
+BACKGROUND_BGR = (245, 245, 245)
+LINE_BGR = (195, 195, 195)
+# Line widths at 1x as a fraction of the cell width
+THIN_LINE_RATIO = 0.03
+THICK_LINE_RATIO = 0.06
+# Opacity of the dots over the background
+DOT_ALPHA = 0.55
+
+DEFAULT_COLORS = ('CYAN', 'GREEN')
+
+
+def _band_midpoints() -> dict[int, float]:
+    """Diameter / cell width in the middle of each size band."""
+    edges = [0.4, *SIZE_THRESHOLDS.values(), 1.75]
+    return {
+        size: (edges[size - 1] + edges[size]) / 2 for size in range(1, 6)
+    }
+
+
+DIAMETER_RATIOS = _band_midpoints()
+
+
+def dot_bgr(color_name: str) -> tuple[int, int, int]:
+    """Fully saturated BGR color at the middle of a COLOR_RANGES band."""
+    ranges = COLOR_RANGES[color_name]
+    lower = ranges.get('lower', ranges.get('lower1'))
+    upper = ranges.get('upper', ranges.get('upper1'))
+    hue = int(lower[0] + upper[0]) // 2
+    hsv = np.uint8([[[hue, 255, 255]]])
+    return tuple(int(v) for v in cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0, 0])
+
+
+def random_grid(
+    rng: np.random.Generator,
+    dot_count: int = 12,
+    colors: Sequence[str] = DEFAULT_COLORS,
+) -> tuple[list, list]:
+    """
+    Random ground truth with dots on cells that are not 8-adjacent.
+
+    Adjacent dots overlap once they reach size 3 or more, which makes
+    the expected size ambiguous, so they are kept apart. Fewer than
+    dot_count dots are placed if no free cell is left.
+
+    Returns:
+        Tuple of (grid_color, grid_size), None for empty cells.
+    """
+    grid_color: list[Optional[str]] = [None] * 81
+    grid_size: list[Optional[int]] = [None] * 81
+    placed = 0
+
+    for index in rng.permutation(81):
+        if placed >= dot_count:
+            break
+        row, col = divmod(int(index), 9)
+        neighbours = [
+            r * 9 + c
+            for r in range(max(0, row - 1), min(9, row + 2))
+            for c in range(max(0, col - 1), min(9, col + 2))
+        ]
+        if any(grid_color[n] is not None for n in neighbours):
+            continue
+        grid_color[index] = str(rng.choice(colors))
+        grid_size[index] = int(rng.integers(1, 6))
+        placed += 1
+
+    return grid_color, grid_size
+
+
+def render_grid(
+    grid_color: list,
+    grid_size: list,
+    scale: float = 1.0,
+    rotation: float = 0.0,
+    noise: float = 0.0,
+    rng: Optional[np.random.Generator] = None,
+) -> np.ndarray:
+    """
+    Draw a grid screenshot for the given ground truth.
+
+    Args:
+        grid_color: 81 color names (keys of COLOR_RANGES) or None
+        grid_size: 81 sizes 1-5 (ignored where the color is None)
+        scale: Resolution relative to the 848x1600 fixtures
+        rotation: Rotation of the whole screenshot in degrees
+        noise: Standard deviation of Gaussian pixel noise
+        rng: Random generator for the noise
+
+    Returns:
+        BGR image.
+    """
+    width = round(BASE_WIDTH * scale)
+    height = round(BASE_HEIGHT * scale)
+    image = np.full((height, width, 3), BACKGROUND_BGR, dtype=np.uint8)
+
+    x0 = BASE_GRID_ORIGIN[0] * scale
+    y0 = BASE_GRID_ORIGIN[1] * scale
+    cell = BASE_GRID_SIZE * scale / 9
+
+    # Sub-pixel drawing: coordinates are fixed point with 4 fraction bits
+    shift = 4
+    one = 1 << shift
+
+    def point(x: float, y: float) -> tuple[int, int]:
+        return round(x * one), round(y * one)
+
+    for i in range(10):
+        thickness = THICK_LINE_RATIO if i % 3 == 0 else THIN_LINE_RATIO
+        thickness = max(1, round(thickness * cell))
+        offset = i * cell
+        cv2.line(
+            image, point(x0 + offset, y0), point(x0 + offset, y0 + 9 * cell),
+            LINE_BGR, thickness, cv2.LINE_AA, shift,
+        )
+        cv2.line(
+            image, point(x0, y0 + offset), point(x0 + 9 * cell, y0 + offset),
+            LINE_BGR, thickness, cv2.LINE_AA, shift,
+        )
+
+    for index, (color, size) in enumerate(zip(grid_color, grid_size)):
+        if color is None:
+            continue
+        row, col = divmod(index, 9)
+        dots = image.copy()
+        cv2.circle(
+            dots,
+            point(x0 + (col + 0.5) * cell, y0 + (row + 0.5) * cell),
+            round(DIAMETER_RATIOS[size] * cell / 2 * one),
+            dot_bgr(color), -1, cv2.LINE_AA, shift,
+        )
+        cv2.addWeighted(dots, DOT_ALPHA, image, 1 - DOT_ALPHA, 0, dst=image)
+
+    if rotation:
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rotation, 1)
+        image = cv2.warpAffine(
+            image, matrix, (width, height),
+            flags=cv2.INTER_LINEAR, borderValue=BACKGROUND_BGR,
+        )
+
+    if noise:
+        rng = rng or np.random.default_rng()
+        noisy = image + rng.normal(0, noise, image.shape)
+        image = np.clip(noisy, 0, 255).astype(np.uint8)
+
+    return image
+
+
+def generate_sample(
+    seed: int,
+    scale: float = 1.0,
+    rotation: float = 0.0,
+    quality: int = 90,
+    noise: float = 0.0,
+    dot_count: int = 12,
+    colors: Sequence[str] = DEFAULT_COLORS,
+) -> dict:
+    """
+    Render one random grid and encode it as JPEG.
+
+    Args:
+        seed: Seed for the layout and noise; same seed, same sample
+        scale: Resolution relative to the 848x1600 fixtures
+        rotation: Maximum rotation in degrees; the sample is rotated by
+            a random angle in [-rotation, rotation]
+        quality: JPEG quality (1-100)
+        noise: Standard deviation of Gaussian pixel noise
+        dot_count: Dots to place
+        colors: Dot colors to choose from
+
+    Returns:
+        Dictionary with image (JPEG bytes), grid_color, grid_size and
+        the rotation applied.
+    """
+    rng = np.random.default_rng(seed)
+    grid_color, grid_size = random_grid(rng, dot_count, colors)
+    angle = float(rng.uniform(-rotation, rotation)) if rotation else 0.0
+    image = render_grid(grid_color, grid_size, scale, angle, noise, rng)
+    _, buffer = cv2.imencode(
+        '.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, int(quality)],
+    )
+    return {
+        'image': buffer.tobytes(),
+        'grid_color': grid_color,
+        'grid_size': grid_size,
+        'rotation': angle,
+    }
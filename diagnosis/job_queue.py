@@ -0,0 +1,331 @@
+"""
+SQLite-backed local job queue for image analysis.
+
+Lets grid parsing and Gemini extraction run in separate worker
+processes (manage.py analysis_worker) instead of the web server. Web
+handlers enqueue one job per image and wait for its result, which one
+poller per event loop checks for all waiting jobs with a single query;
+workers claim queued jobs, run them and store the JSON result. There is no
+broker: the queue is a single SQLite file in WAL mode that every
+process on the host (or a shared volume) opens directly.
+
+The mode is optional and off by default. Set ANALYSIS_JOB_QUEUE=1 on
+the web server and run at least one worker against the same
+JOB_QUEUE_PATH.
+
+Jobs whose worker died are picked up again once their lease expires,
+up to JOB_MAX_ATTEMPTS times.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+import weakref
+from contextlib import closing
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_ENABLED = os.environ.get('ANALYSIS_JOB_QUEUE', '') in (
+    '1', 'true', 'True',
+)
+JOB_QUEUE_PATH = os.environ.get(
+    'JOB_QUEUE_PATH', '/tmp/analysis_jobs.sqlite3',
+)
+
+# Seconds a claimed job may run before another worker may retry it
+JOB_LEASE_SECONDS = 300
+JOB_MAX_ATTEMPTS = 3
+# Seconds a web request waits for a job before giving up
+JOB_WAIT_TIMEOUT = 600
+# First and longest pause between a web process's checks for waiting jobs
+JOB_POLL_INTERVAL = 0.05
+JOB_POLL_MAX_INTERVAL = 1.0
+# Finished jobs are purged after this many seconds
+JOB_RETENTION_SECONDS = 86400
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_id ON jobs (status, id);
+"""
+
+_initialized_paths: set[str] = set()
+
+
+class JobFailed(RuntimeError):
+    """A job ended in the failed state or was not finished in time."""
+
+
+def _connect(path: Optional[str] = None) -> sqlite3.Connection:
+    """Open the queue database, creating the schema on first use."""
+    path = path or JOB_QUEUE_PATH
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if path not in _initialized_paths:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+        _initialized_paths.add(path)
+    return conn
+
+
+def enqueue(kind: str, payload: dict) -> int:
+    """Add a job and return its ID."""
+    with closing(_connect()) as conn:
+        cursor = conn.execute(
+            'INSERT INTO jobs (kind, payload, status, created_at) '
+            'VALUES (?, ?, ?, ?)',
+            (kind, json.dumps(payload), QUEUED, time.time()),
+        )
+        return cursor.lastrowid
+
+
+def claim(kinds: Optional[list[str]] = None) -> Optional[dict]:
+    """
+    Claim the oldest runnable job for a worker.
+
+    Runnable jobs are queued ones and running ones whose lease expired
+    (their worker presumably died) with attempts left. Expired jobs
+    without attempts left are marked failed.
+
+    Args:
+        kinds: Job kinds this worker handles, highest priority first,
+            or None for all in queue order
+
+    Returns:
+        Dict with id, kind and payload, or None if the queue is empty.
+    """
+    now = time.time()
+    query = (
+        'SELECT id, kind, payload FROM jobs '
+        'WHERE (status = ? OR (status = ? AND started_at < ?)) '
+        'AND attempts < ?'
+    )
+    params: list[Any] = [
+        QUEUED, RUNNING, now - JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS,
+    ]
+    order = 'id'
+    if kinds:
+        query += f' AND kind IN ({", ".join("?" * len(kinds))})'
+        params.extend(kinds)
+        order = 'CASE kind {} END, id'.format(
+            ' '.join(f'WHEN ? THEN {rank}' for rank in range(len(kinds)))
+        )
+        params.extend(kinds)
+    query += f' ORDER BY {order} LIMIT 1'
+
+    conn = _connect()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute(
+            'UPDATE jobs SET status = ?, error = ?, finished_at = ? '
+            'WHERE status = ? AND started_at < ? AND attempts >= ?',
+            (FAILED, 'worker lease expired', now,
+             RUNNING, now - JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS),
+        )
+        row = conn.execute(query, params).fetchone()
+        if row is None:
+            conn.execute('COMMIT')
+            return None
+        conn.execute(
+            'UPDATE jobs SET status = ?, started_at = ?, '
+            'attempts = attempts + 1 WHERE id = ?',
+            (RUNNING, now, row['id']),
+        )
+        conn.execute('COMMIT')
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'payload': json.loads(row['payload']),
+    }
+
+
+def complete(job_id: int, result: Any) -> None:
+    """Store a job's JSON-serializable result."""
+    with closing(_connect()) as conn:
+        conn.execute(
+            'UPDATE jobs SET status = ?, result = ?, finished_at = ? '
+            'WHERE id = ?',
+            (DONE, json.dumps(result, ensure_ascii=False), time.time(), job_id),
+        )
+
+
+def fail(job_id: int, error: str) -> None:
+    """Mark a job as failed with an error message."""
+    with closing(_connect()) as conn:
+        conn.execute(
+            'UPDATE jobs SET status = ?, error = ?, finished_at = ? '
+            'WHERE id = ?',
+            (FAILED, error, time.time(), job_id),
+        )
+
+
+def get_job(job_id: int) -> Optional[dict]:
+    """Return a job's status, result and error, or None if unknown."""
+    with closing(_connect()) as conn:
+        row = conn.execute(
+            'SELECT status, result, error FROM jobs WHERE id = ?', (job_id,),
+        ).fetchone()
+    if row is None:
+        return None
+    return {
+        'status': row['status'],
+        'result': json.loads(row['result']) if row['result'] else None,
+        'error': row['error'],
+    }
+
+
+def purge(older_than: float = JOB_RETENTION_SECONDS) -> int:
+    """Delete finished jobs older than the given seconds; returns count."""
+    with closing(_connect()) as conn:
+        cursor = conn.execute(
+            'DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?',
+            (DONE, FAILED, time.time() - older_than),
+        )
+        return cursor.rowcount
+
+
+def count_active() -> dict[tuple[str, str], int]:
+    """Queued and running jobs as {(kind, status): count}."""
+    with closing(_connect()) as conn:
+        rows = conn.execute(
+            'SELECT kind, status, COUNT(*) FROM jobs '
+            'WHERE status IN (?, ?) GROUP BY kind, status',
+            (QUEUED, RUNNING),
+        ).fetchall()
+    return {(kind, status): count for kind, status, count in rows}
+
+
+def get_jobs(job_ids: list[int]) -> dict[int, dict]:
+    """get_job for many jobs in one query; unknown IDs are left out."""
+    jobs = {}
+    with closing(_connect()) as conn:
+        # Stay well below SQLite's limit on query parameters
+        for i in range(0, len(job_ids), 500):
+            chunk = job_ids[i:i + 500]
+            rows = conn.execute(
+                'SELECT id, status, result, error FROM jobs WHERE id IN '
+                f'({", ".join("?" * len(chunk))})',
+                chunk,
+            ).fetchall()
+            for row in rows:
+                jobs[row['id']] = {
+                    'status': row['status'],
+                    'result': (
+                        json.loads(row['result']) if row['result'] else None
+                    ),
+                    'error': row['error'],
+                }
+    return jobs
+
+
+class _JobPoller:
+    """
+    Waits for the jobs of every run_job call on one event loop.
+
+    A single task checks all waiting job IDs with one query in a worker
+    thread, starting at JOB_POLL_INTERVAL and doubling the interval up
+    to JOB_POLL_MAX_INTERVAL while nothing finishes. New jobs reset it.
+    """
+
+    def __init__(self):
+        self.waiting: dict[int, asyncio.Future] = {}
+        self.interval = JOB_POLL_INTERVAL
+        self.task: Optional[asyncio.Task] = None
+
+    def wait(self, job_id: int) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = self.waiting[job_id] = loop.create_future()
+        self.interval = JOB_POLL_INTERVAL
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self._poll())
+        return future
+
+    async def _poll(self) -> None:
+        while self.waiting:
+            await asyncio.sleep(self.interval)
+            # Drop waiters that were cancelled or timed out
+            for job_id, future in list(self.waiting.items()):
+                if future.done():
+                    del self.waiting[job_id]
+            if not self.waiting:
+                break
+
+            job_ids = list(self.waiting)
+            try:
+                jobs = await asyncio.to_thread(get_jobs, job_ids)
+            except sqlite3.Error:
+                logger.exception("Could not poll the job queue")
+                jobs = {job_id: {'status': QUEUED} for job_id in job_ids}
+
+            finished = 0
+            for job_id in job_ids:
+                job = jobs.get(job_id)
+                if job is not None and job['status'] not in (DONE, FAILED):
+                    continue
+                future = self.waiting.pop(job_id)
+                if not future.done():
+                    future.set_result(job)
+                finished += 1
+
+            if finished:
+                self.interval = JOB_POLL_INTERVAL
+            else:
+                self.interval = min(self.interval * 2, JOB_POLL_MAX_INTERVAL)
+
+
+# Event loop -> poller; entries vanish when their loop is collected
+_pollers: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+async def run_job(kind: str, payload: dict) -> Any:
+    """
+    Enqueue a job and wait for a worker to finish it.
+
+    Raises:
+        JobFailed: The job failed, ran out of attempts or did not finish
+            within JOB_WAIT_TIMEOUT seconds.
+    """
+    job_id = await asyncio.to_thread(enqueue, kind, payload)
+    loop = asyncio.get_running_loop()
+    poller = _pollers.get(loop)
+    if poller is None:
+        poller = _pollers[loop] = _JobPoller()
+
+    future = poller.wait(job_id)
+    try:
+        job = await asyncio.wait_for(future, JOB_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise JobFailed(f'{kind} job {job_id} did not finish')
+    finally:
+        future.cancel()
+
+    if job is None:
+        raise JobFailed(f'{kind} job {job_id} no longer exists')
+    if job['status'] == FAILED:
+        raise JobFailed(f'{kind} job {job_id} failed: {job["error"]}')
+    return job['result']
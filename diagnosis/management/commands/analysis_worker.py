@@ -0,0 +1,119 @@
+"""Management command to run image analysis jobs from the local job queue."""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from diagnosis import job_queue
+from diagnosis.ai_service import GEMINI_MAX_CONNECTIONS
+from diagnosis.batch import GRID_JOB, METADATA_JOB, run_queued_job
+
+logger = logging.getLogger(__name__)
+
+# Seconds between purges of old finished jobs
+PURGE_INTERVAL = 3600
+
+
+def work(kinds: list[str], poll_interval: float) -> None:
+    """Claim and run jobs until the process is interrupted."""
+    next_purge = time.monotonic()
+    while True:
+        if time.monotonic() >= next_purge:
+            job_queue.purge()
+            next_purge = time.monotonic() + PURGE_INTERVAL
+
+        job = job_queue.claim(kinds)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        try:
+            result = run_queued_job(job['kind'], job['payload'])
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job['id'], job['kind'])
+            job_queue.fail(job['id'], str(e))
+        else:
+            job_queue.complete(job['id'], result)
+
+
+def work_threaded(kinds: list[str], poll_interval: float, threads: int) -> None:
+    """Run work() on several threads, for jobs that mostly wait on I/O."""
+    workers = [
+        threading.Thread(
+            target=work, args=(kinds, poll_interval), daemon=True,
+        )
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+class Command(BaseCommand):
+    help = (
+        'Run grid parsing and Gemini extraction jobs from the local job '
+        'queue (enable with ANALYSIS_JOB_QUEUE=1 on the web server). Grid '
+        'jobs run in worker processes and metadata jobs on threads of a '
+        'separate process, so Gemini waits never hold up grid parsing.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Grid worker processes to run (default: CPU count)',
+        )
+        parser.add_argument(
+            '--metadata-workers', type=int, default=GEMINI_MAX_CONNECTIONS,
+            help='Metadata jobs to run concurrently, as threads of one '
+                 'process (default: GEMINI_MAX_CONNECTIONS)',
+        )
+        parser.add_argument(
+            '--kind', action='append', choices=[GRID_JOB, METADATA_JOB],
+            help='Only run jobs of this kind (repeatable; default: both)',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=0.2,
+            help='Seconds to wait when the queue is empty',
+        )
+
+    def handle(self, *args, **options):
+        kinds = options['kind'] or [GRID_JOB, METADATA_JOB]
+        poll_interval = options['poll_interval']
+
+        targets = []
+        if GRID_JOB in kinds:
+            workers = max(1, options['workers'])
+            targets += [(work, ([GRID_JOB], poll_interval))] * workers
+            self.stdout.write(f'Running {workers} grid worker process(es)')
+        if METADATA_JOB in kinds:
+            threads = max(1, options['metadata_workers'])
+            targets.append(
+                (work_threaded, ([METADATA_JOB], poll_interval, threads))
+            )
+            self.stdout.write(f'Running {threads} metadata worker thread(s)')
+        self.stdout.write(f'Jobs come from {job_queue.JOB_QUEUE_PATH}')
+
+        if len(targets) == 1:
+            target, args = targets[0]
+            try:
+                target(*args)
+            except KeyboardInterrupt:
+                pass
+            return
+
+        processes = [
+            multiprocessing.Process(target=target, args=args, daemon=True)
+            for target, args in targets
+        ]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
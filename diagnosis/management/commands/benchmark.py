@@ -0,0 +1,273 @@
+"""Management command to benchmark the image pipeline stage by stage."""
+import json
+import logging
+import platform
+import resource
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from diagnosis.image_processing import (
+    ImageSource,
+    load_image,
+    parse_grid,
+    process_image,
+)
+from diagnosis.image_processing.cell_analyzer import PYRAMID_MODE
+from diagnosis.image_processing.grid_detector import (
+    DETECTION_MAX_SIDE,
+    DETECTION_TIERS,
+    detection_image,
+)
+from diagnosis.image_processing.image_loader import (
+    HEADER_READ_SIZE,
+    read_image_size,
+)
+from diagnosis.timing import TIMING_ENABLED, collect
+
+# Whole-call timing, reported alongside the pipeline's own stages
+TOTAL_STAGE = 'parse_grid'
+
+
+def _upscaled_source(source: ImageSource, factor: int) -> ImageSource:
+    """Re-encode an image at factor times its size, like a larger photo."""
+    image, _ = source.decode(reduce=False)
+    big = cv2.resize(
+        image, None, fx=factor, fy=factor, interpolation=cv2.INTER_CUBIC,
+    )
+    _, buffer = cv2.imencode('.jpg', big, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return ImageSource.from_bytes(
+        buffer.tobytes(), name=f'{source.name}@{factor}x',
+    )
+
+
+def _run(source: ImageSource) -> dict | None:
+    """
+    Run the pipeline on one image uncached and return its stage timings.
+
+    The stages are the ones process_image records through
+    diagnosis.timing (decode, detect_*, hsv, cell_color,
+    distance_transform, sizing, visualize); tier_<name> for every
+    DETECTION_TIERS entry run on the detection image, whether or not an
+    earlier tier finds the grid; and the total of an uncached parse_grid
+    call, the request path, under TOTAL_STAGE. Returns None if no grid
+    was found.
+    """
+    with collect() as timings:
+        result = process_image(source)
+    if 'error' in result:
+        return None
+    stages = dict(timings.stages)
+
+    image, _ = load_image(source, reduce=PYRAMID_MODE)
+    detection, _ = detection_image(
+        image, DETECTION_MAX_SIDE if PYRAMID_MODE else None,
+    )
+    for tier, detect in DETECTION_TIERS:
+        start = time.perf_counter()
+        detect(detection)
+        stages[f'tier_{tier}'] = (time.perf_counter() - start) * 1000
+
+    parsed = parse_grid(source, use_cache=False)
+    stages[TOTAL_STAGE] = parsed['timings']['total_ms']
+    return stages
+
+
+def _stats(durations: list[float]) -> dict:
+    return {
+        'p50_ms': round(float(np.percentile(durations, 50)), 3),
+        'p95_ms': round(float(np.percentile(durations, 95)), 3),
+        'mean_ms': round(float(np.mean(durations)), 3),
+        'samples': len(durations),
+    }
+
+
+def _benchmark(sources: list[ImageSource], repeat: int) -> dict | None:
+    """
+    Stage statistics over repeat uncached runs of every source.
+
+    The detect_* stages only show up for images that reach them, so
+    their sample counts can be lower than the other stages'; the
+    tier_* stages always cover every image. Peak memory is measured
+    over one traced parse_grid call per image and reported on the
+    TOTAL_STAGE entry. Returns None if no image has a grid.
+    """
+    sources = [source for source in sources if _run(source) is not None]
+    if not sources:
+        return None
+
+    durations: dict[str, list[float]] = {}
+    for _ in range(repeat):
+        for source in sources:
+            for name, ms in _run(source).items():
+                durations.setdefault(name, []).append(ms)
+
+    peak = 0
+    for source in sources:
+        tracemalloc.start()
+        parse_grid(source, use_cache=False)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    results = {name: _stats(values) for name, values in durations.items()}
+    results[TOTAL_STAGE]['peak_kb'] = round(peak / 1024, 1)
+    return {'images': len(sources), 'stages': results}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the image pipeline over data/test_inputs and upscaled '
+        'variants, reporting p50/p95 per stage and detection tier and '
+        'peak memory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scales', default='1,2,4',
+            help='Comma-separated upscale factors to run (default: 1,2,4)',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Timed runs per image and stage (default: 5)',
+        )
+        parser.add_argument(
+            '--stages', default='',
+            help='Comma-separated stages to report, e.g. '
+                 'decode,tier_lines,visualize (default: all)',
+        )
+        parser.add_argument(
+            '--limit', type=int, default=0,
+            help='Only use the first N test images',
+        )
+        parser.add_argument(
+            '--output', default='',
+            help='Write results as a JSON baseline to this path',
+        )
+        parser.add_argument(
+            '--compare', default='',
+            help='Compare p50 timings against a JSON baseline',
+        )
+        parser.add_argument(
+            '--max-regression', type=float, default=0,
+            help='With --compare, fail if any p50 is this many percent '
+                 'slower than the baseline',
+        )
+
+    def handle(self, *args, **options):
+        test_dir = Path(settings.BASE_DIR) / 'data' / 'test_inputs'
+        image_paths = sorted(test_dir.glob('*.jpeg'))
+        if options['limit']:
+            image_paths = image_paths[:options['limit']]
+        if not image_paths:
+            raise CommandError(f'No JPEG images found in {test_dir}')
+
+        if not TIMING_ENABLED:
+            raise CommandError('Stage timings need PIPELINE_TIMING enabled')
+        # One log line per parse would drown the report
+        logging.getLogger('diagnosis.timing').setLevel(logging.WARNING)
+
+        stage_names = [
+            name for name in options['stages'].split(',') if name
+        ]
+        scales = [int(s) for s in options['scales'].split(',') if s]
+
+        sources = [ImageSource.from_path(path) for path in image_paths]
+        results = {}
+        for scale in scales:
+            label = f'{scale}x'
+            scaled = sources if scale == 1 else [
+                _upscaled_source(source, scale) for source in sources
+            ]
+            run = _benchmark(scaled, options['repeat'])
+            if run is None:
+                self.stderr.write(f'{label}: no grid detected, skipping')
+                continue
+
+            stages = run['stages']
+            if stage_names:
+                unknown = set(stage_names) - set(stages)
+                if unknown:
+                    raise CommandError(
+                        f'Unknown stages: {", ".join(sorted(unknown))} '
+                        f'(recorded: {", ".join(stages)})'
+                    )
+                stages = {name: stages[name] for name in stage_names}
+
+            width, height = read_image_size(
+                scaled[0].data[:HEADER_READ_SIZE]
+            ) or (0, 0)
+            self.stdout.write(
+                f'\n{label}: {run["images"]} images of {width}x{height}, '
+                f'repeat {options["repeat"]}'
+            )
+            self.stdout.write(
+                f'  {"stage":<20}{"p50 ms":>10}{"p95 ms":>10}{"samples":>9}'
+            )
+            results[label] = stages
+            for name, stats in stages.items():
+                self.stdout.write(
+                    f'  {name:<20}{stats["p50_ms"]:>10.2f}'
+                    f'{stats["p95_ms"]:>10.2f}{stats["samples"]:>9}'
+                )
+            if 'peak_kb' in stages.get(TOTAL_STAGE, {}):
+                self.stdout.write(
+                    f'  {TOTAL_STAGE} peak traced memory: '
+                    f'{stages[TOTAL_STAGE]["peak_kb"]:.1f} KB'
+                )
+
+        max_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.stdout.write(f'\nProcess peak RSS: {max_rss_kb / 1024:.1f} MB')
+
+        report = {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'git_commit': settings.GIT_COMMIT,
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'images': len(image_paths),
+            'repeat': options['repeat'],
+            'max_rss_kb': max_rss_kb,
+            'results': results,
+        }
+
+        if options['output']:
+            output_path = Path(options['output'])
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            output_path.write_text(json.dumps(report, indent=2) + '\n')
+            self.stdout.write(f'Wrote baseline to {output_path}')
+
+        if options['compare']:
+            self._compare(results, options['compare'], options['max_regression'])
+
+    def _compare(self, results: dict, baseline_path: str, max_regression: float):
+        """Print p50 changes against a baseline and enforce the limit."""
+        try:
+            baseline = json.loads(Path(baseline_path).read_text())['results']
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f'Could not read baseline {baseline_path}: {e}')
+
+        self.stdout.write(f'\nCompared with {baseline_path} (p50):')
+        regressions = []
+        for label, stages in results.items():
+            for name, stats in stages.items():
+                before = baseline.get(label, {}).get(name)
+                if not before or not before['p50_ms']:
+                    continue
+                change = (stats['p50_ms'] / before['p50_ms'] - 1) * 100
+                self.stdout.write(
+                    f'  {label:<4}{name:<20}{before["p50_ms"]:>10.2f}'
+                    f' -> {stats["p50_ms"]:>8.2f} ms ({change:+.1f}%)'
+                )
+                if max_regression and change > max_regression:
+                    regressions.append(f'{label} {name} {change:+.1f}%')
+
+        if regressions:
+            raise CommandError(
+                'Slower than baseline: ' + ', '.join(regressions)
+            )
@@ -0,0 +1,226 @@
+"""Management command to report which grid detection tiers images need."""
+import json
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from diagnosis.image_processing import cell_analyzer
+from diagnosis.image_processing.grid_detector import (
+    DETECTION_MAX_SIDE,
+    DETECTION_TIERS,
+    detect_grid,
+)
+from diagnosis.image_processing.image_loader import (
+    HEADER_READ_SIZE,
+    ImageSource,
+    load_image,
+    read_image_size,
+)
+
+IMAGE_SUFFIXES = {'.jpg', '.jpeg', '.png'}
+LOG_SUFFIXES = {'.json', '.jsonl', '.log'}
+
+
+def _detect_image(path: Path) -> dict:
+    """Run grid detection as parse_grid does and record the attempts."""
+    source = ImageSource.from_path(path)
+    size = read_image_size(source.data[:HEADER_READ_SIZE])
+    record = {
+        'image': str(path),
+        'size': f'{size[0]}x{size[1]}' if size else None,
+        'tier': None,
+        'attempts': [],
+    }
+
+    pyramid = cell_analyzer.PYRAMID_MODE
+    image, _ = load_image(source, reduce=pyramid)
+    if image is None:
+        record['error'] = 'could not load image'
+        return record
+
+    attempts = record['attempts']
+    grid_info = detect_grid(
+        image, max_side=DETECTION_MAX_SIDE if pyramid else None,
+        attempts=attempts,
+    )
+    if grid_info is not None:
+        record['tier'] = grid_info['detection_tier']
+    return record
+
+
+def _log_entries(path: Path):
+    """
+    parse_grid timing entries from a log file.
+
+    Accepts the diagnosis.timing JSON lines as written to stdout, one
+    per line, and Cloud Logging exports (JSON array or lines) whose
+    entries carry them as jsonPayload.
+    """
+    text = path.read_text(errors='replace')
+    if text.lstrip().startswith('['):
+        entries = json.loads(text)
+    else:
+        entries = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line.startswith('{'):
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        entry = entry.get('jsonPayload', entry)
+        if (
+            entry.get('event') == 'parse_grid'
+            and entry.get('detection_attempts')
+        ):
+            yield {
+                'image': entry.get('image'),
+                'size': None,
+                'tier': entry.get('detection_tier'),
+                'attempts': entry['detection_attempts'],
+            }
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    return round(float(np.percentile(values, q)), 3) if values else None
+
+
+def _tier_stats(records: list[dict]) -> dict:
+    """Found/attempted counts and attempt costs per tier."""
+    stats = {}
+    for tier, _ in DETECTION_TIERS:
+        costs = [
+            attempt['ms']
+            for record in records
+            for attempt in record['attempts']
+            if attempt['tier'] == tier
+        ]
+        stats[tier] = {
+            'found': sum(record['tier'] == tier for record in records),
+            'attempted': len(costs),
+            'p50_ms': _percentile(costs, 50),
+            'p95_ms': _percentile(costs, 95),
+            'mean_ms': round(float(np.mean(costs)), 3) if costs else None,
+        }
+    return stats
+
+
+def _detection_ms(record: dict) -> float:
+    return sum(attempt['ms'] for attempt in record['attempts'])
+
+
+class Command(BaseCommand):
+    help = (
+        'Aggregate which grid detection tier (color, lines, contour) '
+        'images need and what each attempted tier costs, from images or '
+        'parse_grid timing logs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='*',
+            help='Image files or directories to run detection on, and/or '
+                 '.json/.jsonl/.log files of parse_grid timing lines '
+                 '(default: MEDIA_ROOT/uploads)',
+        )
+        parser.add_argument(
+            '--top', type=int, default=10,
+            help='List this many of the slowest images that needed a '
+                 'fallback tier or failed (default: 10)',
+        )
+        parser.add_argument(
+            '--output', default='',
+            help='Write the summary and per-image records as JSON',
+        )
+
+    def handle(self, *args, **options):
+        paths = [Path(p) for p in options['paths']] or [
+            Path(settings.MEDIA_ROOT) / 'uploads'
+        ]
+
+        records = []
+        for path in paths:
+            if path.is_dir():
+                for image_path in sorted(path.rglob('*')):
+                    if image_path.suffix.lower() in IMAGE_SUFFIXES:
+                        records.append(_detect_image(image_path))
+            elif path.suffix.lower() in IMAGE_SUFFIXES:
+                records.append(_detect_image(path))
+            elif path.suffix.lower() in LOG_SUFFIXES:
+                try:
+                    records.extend(_log_entries(path))
+                except (OSError, ValueError) as e:
+                    raise CommandError(f'Could not read {path}: {e}')
+            else:
+                raise CommandError(f'Not an image, directory or log: {path}')
+
+        unreadable = [record for record in records if 'error' in record]
+        for record in unreadable:
+            self.stderr.write(f'SKIP {record["image"]}: {record["error"]}')
+        records = [record for record in records if 'error' not in record]
+        if not records:
+            raise CommandError('No images or parse_grid log entries found')
+
+        total = len(records)
+        failed = sum(record['tier'] is None for record in records)
+        stats = _tier_stats(records)
+
+        self.stdout.write(f'{total} images, {failed} without a grid')
+        self.stdout.write(
+            f'  {"tier":<10}{"found":>7}{"share":>9}{"attempted":>11}'
+            f'{"p50 ms":>10}{"p95 ms":>10}{"mean ms":>10}'
+        )
+        for tier, tier_stats in stats.items():
+            costs = ''.join(
+                f'{tier_stats[key]:>10.2f}' if tier_stats[key] is not None
+                else f'{"-":>10}'
+                for key in ('p50_ms', 'p95_ms', 'mean_ms')
+            )
+            self.stdout.write(
+                f'  {tier:<10}{tier_stats["found"]:>7}'
+                f'{tier_stats["found"] / total:>9.1%}'
+                f'{tier_stats["attempted"]:>11}{costs}'
+            )
+
+        fallbacks = sorted(
+            (
+                record for record in records
+                if record['tier'] != DETECTION_TIERS[0][0]
+            ),
+            key=_detection_ms,
+            reverse=True,
+        )
+        if fallbacks and options['top']:
+            self.stdout.write(
+                f'\nSlowest images past the {DETECTION_TIERS[0][0]} tier:'
+            )
+            for record in fallbacks[:options['top']]:
+                attempts = ', '.join(
+                    f'{attempt["tier"]} {attempt["ms"]:.1f} ms'
+                    f'{"" if attempt["found"] else " (miss)"}'
+                    for attempt in record['attempts']
+                )
+                size = f' {record["size"]}' if record['size'] else ''
+                self.stdout.write(
+                    f'  {record["tier"] or "failed":<8}'
+                    f'{_detection_ms(record):>8.1f} ms  '
+                    f'{record["image"]}{size}: {attempts}'
+                )
+
+        if options['output']:
+            output_path = Path(options['output'])
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            output_path.write_text(json.dumps({
+                'images': total,
+                'failed': failed,
+                'tiers': stats,
+                'records': records,
+            }, indent=2) + '\n')
+            self.stdout.write(f'Wrote report to {output_path}')
@@ -0,0 +1,142 @@
+"""Management command to generate synthetic grid images with ground truth."""
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from diagnosis.image_processing import ImageSource, parse_grid
+from diagnosis.image_processing.cell_analyzer import COLOR_RANGES
+from diagnosis.image_processing.synthetic import (
+    DEFAULT_COLORS,
+    generate_sample,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate synthetic 9x9 grid images with ground-truth grid_color '
+        'and grid_size, optionally checking parse_grid accuracy and speed'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--count', type=int, default=20,
+            help='Images per scale (default: 20)',
+        )
+        parser.add_argument(
+            '--scales', default='1',
+            help='Comma-separated resolutions relative to the fixtures, '
+                 'e.g. 1,2,4,8 (default: 1)',
+        )
+        parser.add_argument(
+            '--rotation', type=float, default=0,
+            help='Maximum random rotation in degrees',
+        )
+        parser.add_argument(
+            '--quality', type=int, default=90,
+            help='JPEG quality (default: 90)',
+        )
+        parser.add_argument(
+            '--noise', type=float, default=0,
+            help='Gaussian pixel noise standard deviation',
+        )
+        parser.add_argument(
+            '--dots', type=int, default=12,
+            help='Dots per image (default: 12)',
+        )
+        parser.add_argument(
+            '--colors', default=','.join(DEFAULT_COLORS),
+            help=f'Dot colors (default: {",".join(DEFAULT_COLORS)})',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Seed of the first image; image i uses seed + i',
+        )
+        parser.add_argument(
+            '--output', default='',
+            help='Directory to write NNNN.jpeg and NNNN.json files to',
+        )
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Run parse_grid on each image and report accuracy and '
+                 'throughput',
+        )
+
+    def handle(self, *args, **options):
+        colors = [c for c in options['colors'].split(',') if c]
+        unknown = set(colors) - set(COLOR_RANGES)
+        if unknown or not colors:
+            raise CommandError(
+                f'Colors must be among {", ".join(COLOR_RANGES)}'
+            )
+        scales = [float(s) for s in options['scales'].split(',') if s]
+        if not options['output'] and not options['check']:
+            raise CommandError('Nothing to do: pass --output and/or --check')
+
+        for scale in scales:
+            label = f'{scale:g}x'
+            output_dir = None
+            if options['output']:
+                output_dir = Path(options['output'])
+                if len(scales) > 1:
+                    output_dir = output_dir / label
+                output_dir.mkdir(parents=True, exist_ok=True)
+
+            durations = []
+            failed = 0
+            wrong_color = 0
+            wrong_size = 0
+            for i in range(options['count']):
+                sample = generate_sample(
+                    options['seed'] + i,
+                    scale=scale,
+                    rotation=options['rotation'],
+                    quality=options['quality'],
+                    noise=options['noise'],
+                    dot_count=options['dots'],
+                    colors=colors,
+                )
+
+                name = f'{i:04d}'
+                if output_dir is not None:
+                    (output_dir / f'{name}.jpeg').write_bytes(sample['image'])
+                    (output_dir / f'{name}.json').write_text(json.dumps({
+                        'grid_color': sample['grid_color'],
+                        'grid_size': sample['grid_size'],
+                        'rotation': sample['rotation'],
+                    }))
+
+                if not options['check']:
+                    continue
+
+                source = ImageSource.from_bytes(
+                    sample['image'], name=f'{name}.jpeg',
+                )
+                start = time.perf_counter()
+                result = parse_grid(source, use_cache=False)
+                durations.append(time.perf_counter() - start)
+
+                if not result['success']:
+                    failed += 1
+                    continue
+                for got, want in zip(result['grid_color'], sample['grid_color']):
+                    wrong_color += got != want
+                for got, want in zip(result['grid_size'], sample['grid_size']):
+                    wrong_size += got != want
+
+            if output_dir is not None:
+                self.stdout.write(
+                    f'{label}: wrote {options["count"]} images to {output_dir}'
+                )
+            if options['check']:
+                cells = (options['count'] - failed) * 81
+                total = sum(durations)
+                self.stdout.write(
+                    f'{label}: {options["count"]} images, {failed} failed, '
+                    f'color accuracy {1 - wrong_color / max(cells, 1):.2%}, '
+                    f'size accuracy {1 - wrong_size / max(cells, 1):.2%}, '
+                    f'p50 {np.percentile(durations, 50) * 1000:.1f} ms, '
+                    f'{options["count"] / total:.1f} images/s'
+                )
@@ -0,0 +1,308 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Counters, gauges and histograms register themselves in REGISTRY when
+created, and REGISTRY.render() produces the text exposition format
+(version 0.0.4) served at /metrics, which requires METRICS_TOKEN or
+METRICS_PUBLIC to be set. Values are per process; queue workers
+(manage.py analysis_worker) keep their own and are not included.
+
+Label values are passed as keyword arguments, e.g.
+GRID_DETECTIONS.inc(tier='lines'). The pipeline's metrics are defined
+at the bottom of this module.
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [
+        f'{name}="{_escape(str(value))}"'
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Registry:
+    """Named metrics, rendered together in the text format."""
+
+    def __init__(self):
+        self._metrics: dict[str, '_Metric'] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: '_Metric') -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric already registered: {metric.name}')
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    type = ''
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        registry: Optional[Registry] = REGISTRY,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f'{self.name} expects labels {self.labelnames}, '
+                f'got {tuple(labels)}'
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Monotonically increasing count."""
+
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return [
+            f'{self.name}{_format_labels(self.labelnames, key)} '
+            f'{_format_value(value)}'
+            for key, value in values
+        ]
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down.
+
+    set_function() makes the gauge read its value at render time
+    instead: a number, or with labels a dict mapping label value tuples
+    to numbers.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable] = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    @contextmanager
+    def track_inprogress(self, **labels) -> Iterator[None]:
+        """Increment while the block runs."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def set_function(self, function: Callable) -> None:
+        self._function = function
+
+    def samples(self) -> list[str]:
+        if self._function is not None:
+            try:
+                values = self._function()
+            except Exception:
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        return [
+            f'{self.name}{_format_labels(self.labelnames, key)} '
+            f'{_format_value(value)}'
+            for key, value in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, with sum and count."""
+
+    type = 'histogram'
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the block's duration in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            values = [
+                (key, list(counts), total)
+                for key, (counts, total) in self._values.items()
+            ]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f'{self.name}_bucket'
+                    f'{_format_labels(self.labelnames, key, le)} {cumulative}'
+                )
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+# Grid parsing
+PARSE_GRID_SECONDS = Histogram(
+    'shoulderinsight_parse_grid_seconds',
+    'parse_grid duration by cache outcome (hit, miss, off)',
+    ('cache',),
+)
+PARSE_GRID_STAGE_SECONDS = Histogram(
+    'shoulderinsight_parse_grid_stage_seconds',
+    'Exclusive parse_grid stage durations (needs PIPELINE_TIMING)',
+    ('stage',),
+)
+GRID_DETECTIONS = Counter(
+    'shoulderinsight_grid_detections_total',
+    'Grid detections by the tier that found the grid '
+    '(color, lines, contour) or failed',
+    ('tier',),
+)
+GRID_DETECTION_TIER_SECONDS = Histogram(
+    'shoulderinsight_grid_detection_tier_seconds',
+    'Cost of each attempted grid detection tier, found or not',
+    ('tier',),
+)
+GRID_PARSES_IN_PROGRESS = Gauge(
+    'shoulderinsight_grid_parses_in_progress',
+    'Grid parses waiting for or running on the CV pool or a queue worker',
+)
+CV_POOL_WORKERS = Gauge(
+    'shoulderinsight_cv_pool_workers',
+    'Threads in the grid parsing pool',
+)
+JOB_QUEUE_JOBS = Gauge(
+    'shoulderinsight_job_queue_jobs',
+    'Jobs in the SQLite job queue by kind and status',
+    ('kind', 'status'),
+)
+
+# Gemini metadata extraction
+GEMINI_REQUEST_SECONDS = Histogram(
+    'shoulderinsight_gemini_request_seconds',
+    'Gemini generate_content call duration',
+    buckets=(0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0),
+)
+GEMINI_REQUESTS = Counter(
+    'shoulderinsight_gemini_requests_total',
+    'Metadata extractions by outcome (success, error, cache_hit)',
+    ('outcome',),
+)
+
+# Analysis requests
+ANALYZE_REQUESTS_IN_PROGRESS = Gauge(
+    'shoulderinsight_analyze_requests_in_progress',
+    'Analysis requests being processed, by endpoint',
+    ('endpoint',),
+)
+ANALYZE_SECONDS = Histogram(
+    'shoulderinsight_analyze_seconds',
+    'Analysis request duration until all grids are scored, by endpoint',
+    ('endpoint',),
+)
+EXAMINATION_IMAGES = Histogram(
+    'shoulderinsight_examination_images',
+    'Images per analyzed examination',
+    buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15, 20),
+)
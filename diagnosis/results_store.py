@@ -0,0 +1,88 @@
+"""
+Examination results store.
+
+Keeps each examination's upload details and analysis results in one
+record keyed by examination ID, so the session only has to carry the
+ID. Records live in a ResultCache with a file tier (RESULTS_DIR), which
+keeps recent records in memory and the rest on disk until RESULTS_TTL,
+pruning the oldest beyond RESULTS_MAX_ENTRIES.
+Async views use the a-prefixed functions, which keep the file reads
+and writes off the event loop.
+
+Gemini metadata is not part of the record; it is kept by the
+background metadata job (batch.get_metadata_job).
+"""
+import asyncio
+import os
+import threading
+from typing import Optional
+
+from .caching import ResultCache
+
+RESULTS_DIR = os.environ.get('RESULTS_DIR', '/tmp/examination_results')
+RESULTS_TTL = int(os.environ.get('RESULTS_TTL', str(86400)))
+# Records kept on disk; /tmp on Cloud Run counts against memory
+RESULTS_MAX_ENTRIES = int(os.environ.get('RESULTS_MAX_ENTRIES', '500'))
+
+_results = ResultCache(
+    'examinations',
+    max_entries=256,
+    directory=RESULTS_DIR or None,
+    ttl=RESULTS_TTL,
+    max_disk_entries=RESULTS_MAX_ENTRIES,
+)
+# Serializes save_analysis's read-modify-write of a record
+_save_lock = threading.Lock()
+
+
+def create_examination(
+    examination_id: str,
+    operator_name: str,
+    image_paths: list[str],
+) -> None:
+    """Store a new examination before it is analyzed."""
+    _results.set(examination_id, {
+        'operator_name': operator_name,
+        'image_paths': image_paths,
+        'parsed_grids': None,
+        'accumulated_scores': None,
+    })
+
+
+def get_examination(examination_id: str) -> Optional[dict]:
+    """
+    Return an examination record, or None if unknown or expired.
+
+    Records have operator_name, image_paths, and parsed_grids and
+    accumulated_scores (None until analyzed).
+    """
+    return _results.get(examination_id)
+
+
+async def aget_examination(examination_id: str) -> Optional[dict]:
+    """get_examination for async code; file reads run in a thread."""
+    return await _results.aget(examination_id)
+
+
+def save_analysis(
+    examination_id: str,
+    parsed_grids: list[dict],
+    accumulated_scores: dict,
+) -> None:
+    """Store the analysis results of an examination."""
+    with _save_lock:
+        record = get_examination(examination_id) or {}
+        record['parsed_grids'] = parsed_grids
+        record['accumulated_scores'] = accumulated_scores
+        _results.set(examination_id, record)
+
+
+async def asave_analysis(
+    examination_id: str,
+    parsed_grids: list[dict],
+    accumulated_scores: dict,
+) -> None:
+    """save_analysis for async code, run in a thread."""
+    await asyncio.to_thread(
+        save_analysis, examination_id, parsed_grids, accumulated_scores,
+    )
@@ -1,3 +1,59 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from io import StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+
+from diagnosis.image_processing.grid_detector import DETECTION_TIERS
+
+
+class BenchmarkTests(SimpleTestCase):
+    """
+    Smoke run of manage.py benchmark over a few test images.
+
+    Run with ``python manage.py test diagnosis.tests``; diagnosis has no
+    __init__.py, so test discovery does not find this module on its own.
+
+    Set BENCHMARK_BASELINE to a JSON baseline written with --output to
+    also fail when any p50 is more than BENCHMARK_MAX_REGRESSION percent
+    (default 25) slower than it.
+    """
+
+    STAGES = (
+        'decode', 'hsv', 'cell_color', 'distance_transform', 'visualize',
+        *(f'tier_{tier}' for tier, _ in DETECTION_TIERS),
+        'parse_grid',
+    )
+
+    def test_reports_every_stage(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = Path(tmp) / 'benchmark.json'
+            options = {
+                'scales': '1', 'repeat': 1, 'limit': 2,
+                'output': str(output), 'stdout': StringIO(),
+            }
+            baseline = os.environ.get('BENCHMARK_BASELINE')
+            if baseline:
+                options.update(
+                    scales='1,2,4', repeat=5, limit=0, compare=baseline,
+                    max_regression=float(
+                        os.environ.get('BENCHMARK_MAX_REGRESSION', '25')
+                    ),
+                )
+            try:
+                call_command('benchmark', **options)
+            except CommandError as e:
+                self.fail(str(e))
+            report = json.loads(output.read_text())
+
+        stages = report['results']['1x']
+        for name in self.STAGES:
+            self.assertIn(name, stages)
+            self.assertGreater(stages[name]['samples'], 0)
+            self.assertLessEqual(
+                stages[name]['p50_ms'], stages[name]['p95_ms'],
+            )
+        self.assertGreater(stages['parse_grid']['peak_kb'], 0)
@@ -0,0 +1,171 @@
+"""
+Per-stage timing of the analysis pipeline.
+
+Pipeline code marks its stages with ``with stage('decode'):`` or the
+@timed('decode') decorator. Durations are only recorded inside a
+collect() block, which binds a StageTimings to the current context
+(thread or asyncio task); everywhere else, and always when
+PIPELINE_TIMING is off, stage() is a context-variable lookup that
+returns a shared no-op context manager.
+
+Stages may nest. Each records its own (exclusive) time, so time spent
+in an inner stage is not counted again in the outer one and the stage
+durations add up to at most the total.
+
+log_timings() writes a StageTimings as one JSON line on the
+diagnosis.timing logger, which Cloud Run picks up as a structured log
+entry.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+TIMING_ENABLED = os.environ.get('PIPELINE_TIMING', '1') in ('1', 'true', 'True')
+
+_current: ContextVar[Optional['StageTimings']] = ContextVar(
+    'stage_timings', default=None,
+)
+_NO_TIMING = nullcontext()
+
+
+class StageTimings:
+    """Exclusive milliseconds per stage name, plus free-form tags."""
+
+    __slots__ = ('stages', 'tags', 'total_ms', '_start', '_nested')
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+        self.tags: dict[str, Any] = {}
+        self.total_ms: Optional[float] = None
+        self._start = time.perf_counter()
+        # Time spent in stages nested inside the one currently running
+        self._nested = 0.0
+
+    def add(self, name: str, ms: float) -> None:
+        """Add ms to a stage; repeated stages accumulate."""
+        self.stages[name] = self.stages.get(name, 0.0) + ms
+
+    def stop(self) -> None:
+        """Fix the total at the time elapsed since creation."""
+        self.total_ms = (time.perf_counter() - self._start) * 1000
+
+    def as_dict(self) -> dict:
+        """Tags plus total_ms and stages, rounded to microseconds."""
+        total_ms = self.total_ms
+        if total_ms is None:
+            total_ms = (time.perf_counter() - self._start) * 1000
+        return {
+            **self.tags,
+            'total_ms': round(total_ms, 3),
+            'stages': {
+                name: round(ms, 3) for name, ms in self.stages.items()
+            },
+        }
+
+
+class _Stage:
+    """Context manager recording one stage into a StageTimings."""
+
+    __slots__ = ('timings', 'name', 'start', 'outer_nested')
+
+    def __init__(self, timings: StageTimings, name: str):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.outer_nested = self.timings._nested
+        self.timings._nested = 0.0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = (time.perf_counter() - self.start) * 1000
+        timings = self.timings
+        timings.add(self.name, elapsed - timings._nested)
+        timings._nested = self.outer_nested + elapsed
+        return False
+
+
+def stage(name: str, timings: Optional[StageTimings] = None):
+    """
+    Context manager timing a stage of the collect() block in progress.
+
+    Code that cannot hold a collect() open across its stages, such as an
+    async generator that yields between them, passes its StageTimings
+    explicitly instead.
+    """
+    if timings is None:
+        timings = _current.get()
+        if timings is None:
+            return _NO_TIMING
+    return _Stage(timings, name)
+
+
+def timed(name: str):
+    """Decorator timing every call of a function (sync or async) as a stage."""
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def tag(key: str, value: Any) -> None:
+    """Attach a value (e.g. the detection tier) to the current timings."""
+    timings = _current.get()
+    if timings is not None:
+        timings.tags[key] = value
+
+
+@contextmanager
+def collect() -> Iterator[Optional[StageTimings]]:
+    """
+    Record stages run in this context until the block exits.
+
+    Yields the StageTimings, or None when PIPELINE_TIMING is off. A
+    nested collect() records separately from the outer one. Work handed
+    to a thread pool via run_in_executor does not inherit the context,
+    so it needs its own collect().
+    """
+    if not TIMING_ENABLED:
+        yield None
+        return
+
+    timings = StageTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+        timings.stop()
+
+
+def log_timings(
+    event: str,
+    timings: Optional[StageTimings],
+    **fields: Any,
+) -> None:
+    """Log timings as a single JSON line: event, fields, tags and stages."""
+    if timings is None or not logger.isEnabledFor(logging.INFO):
+        return
+    logger.info(json.dumps(
+        {'event': event, **fields, **timings.as_dict()},
+        ensure_ascii=False, default=str,
+    ))
@@ -7,6 +7,8 @@ urlpatterns = [
     path('upload/', views.upload_view, name='upload'),
     path('analyzing/<uuid:examination_id>/', views.analyzing_view, name='analyzing'),
     path('api/analyze/<uuid:examination_id>/', views.analyze_api, name='analyze_api'),
+    path('api/analyze/<uuid:examination_id>/stream/', views.analyze_stream_api, name='analyze_stream_api'),
+    path('api/metadata/<uuid:examination_id>/', views.metadata_api, name='metadata_api'),
     path('result/<uuid:examination_id>/', views.result_view, name='result'),
     path('diseases/', views.diseases_view, name='diseases'),
     path('analyze-verify/', views.analyze_verify_view, name='analyze_verify'),
@@ -1,27 +1,60 @@
 import base64
+import hmac
 import json
 import logging
 import os
 import random
+import time
 import uuid
+from contextlib import aclosing
 from pathlib import Path
 
 import cv2
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from django.urls import reverse
 from django.views.decorators.cache import never_cache
 from django.views.decorators.http import require_POST
 
-from .ai_service import analyze_training_image
+from .batch import (
+    METADATA_DONE,
+    aget_metadata_job,
+    get_metadata_job,
+    iter_analysis_async,
+    load_batch,
+    parse_grids_async,
+    start_metadata_job,
+)
+from .caching import ResultCache, content_key
 from .disease_mapping import (
+    MedianGridAccumulator,
     accumulate_disease_scores,
+    expand_disease_results,
     get_all_diseases,
+    get_compiled_diseases,
+    score_merged_grid,
     simulate_disease_scores,
 )
-from .image_processing import parse_grid, process_image
+from .image_processing import (
+    ImageSource,
+    detection_params_version,
+    process_image,
+)
+from .metrics import (
+    ANALYZE_REQUESTS_IN_PROGRESS,
+    ANALYZE_SECONDS,
+    EXAMINATION_IMAGES,
+    REGISTRY,
+)
+from .results_store import (
+    aget_examination,
+    asave_analysis,
+    create_examination,
+    get_examination,
+)
+from .timing import TIMING_ENABLED, StageTimings, collect, log_timings, stage
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +66,10 @@ MAGIC_BYTES = {
     b'\xff\xd8\xff': 'jpeg',
     b'\x89PNG\r\n\x1a\n': 'png',
 }
+# /metrics needs this bearer token; without one it is only served when
+# METRICS_PUBLIC is set
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '') in ('1', 'true', 'True')
 
 
 def _validate_image_magic_bytes(file_obj: object) -> bool:
@@ -41,6 +78,20 @@ def _validate_image_magic_bytes(file_obj: object) -> bool:
     return any(header.startswith(sig) for sig in MAGIC_BYTES)
 
 
+def _owned_examination(session_exam_id, examination_id) -> dict | None:
+    """Return the examination record if the session owns it, else None."""
+    if session_exam_id != str(examination_id):
+        return None
+    return get_examination(session_exam_id)
+
+
+async def _aowned_examination(session_exam_id, examination_id) -> dict | None:
+    """_owned_examination for async views."""
+    if session_exam_id != str(examination_id):
+        return None
+    return await aget_examination(session_exam_id)
+
+
 def upload_view(request):
     """Upload page for multiple examination images."""
     if request.method == 'POST':
@@ -89,13 +140,9 @@ def upload_view(request):
 
             image_paths.append(image_path)
 
+        # Only the ID goes in the session; results live in results_store
+        create_examination(examination_id, operator_name, image_paths)
         request.session['examination_id'] = examination_id
-        request.session['operator_name'] = operator_name
-        request.session['image_paths'] = image_paths
-        request.session['ai_result'] = None
-        request.session['accumulated_scores'] = None
-        request.session['parsed_grids'] = None
-        request.session['ai_results'] = None
 
         return redirect('diagnosis:analyzing', examination_id=examination_id)
 
@@ -107,15 +154,17 @@ def analyzing_view(request, examination_id):
     Analyzing page - displays loading animation.
     AI analysis is triggered via AJAX from the frontend.
     """
-    session_exam_id = request.session.get('examination_id')
-    if session_exam_id != str(examination_id):
+    examination = _owned_examination(
+        request.session.get('examination_id'), examination_id,
+    )
+    if examination is None:
         messages.error(request, '無效的分析請求')
         return redirect('diagnosis:upload')
 
-    if request.session.get('accumulated_scores'):
+    if examination['accumulated_scores']:
         return redirect('diagnosis:result', examination_id=examination_id)
 
-    image_count = len(request.session.get('image_paths', []))
+    image_count = len(examination['image_paths'])
     return render(request, 'diagnosis/analyzing.html', {
         'examination_id': examination_id,
         'image_count': image_count,
@@ -123,88 +172,261 @@ def analyzing_view(request, examination_id):
 
 
 @require_POST
-def analyze_api(request, examination_id):
+async def analyze_api(request, examination_id):
     """
     API endpoint to trigger batch AI analysis and grid parsing.
     Processes all uploaded images and accumulates scores.
+
+    Runs natively on ASGI: grid parsing is offloaded to a bounded pool
+    and the response only waits for it. Gemini metadata extraction runs
+    as a background job that the result page polls via metadata_api.
     """
-    session_exam_id = request.session.get('examination_id')
-    if session_exam_id != str(examination_id):
+    examination = await _aowned_examination(
+        await request.session.aget('examination_id'), examination_id,
+    )
+    if examination is None:
         return JsonResponse({'error': '無效的分析請求'}, status=400)
 
-    if request.session.get('accumulated_scores'):
+    if examination['accumulated_scores']:
         redirect_url = reverse(
             'diagnosis:result', kwargs={'examination_id': examination_id}
         )
         return JsonResponse({'success': True, 'redirect_url': redirect_url})
 
-    image_paths = request.session.get('image_paths', [])
+    image_paths = examination['image_paths']
     if not image_paths:
         return JsonResponse({'error': '找不到上傳的圖片'}, status=400)
 
-    parsed_grids = []
-    ai_results = []
-
-    for image_path in image_paths:
-        if not os.path.exists(image_path):
-            logger.warning("Image file missing: %s", image_path)
-            continue
-
-        try:
-            parsed_result = parse_grid(image_path)
-        except Exception as e:
-            logger.exception("Grid parsing failed for %s", image_path)
-            parsed_result = {
-                'success': False,
-                'grid_color': [None] * 81,
-                'grid_size': [0] * 81,
-            }
-
-        stripped = {
-            'success': parsed_result.get('success', False),
-            'grid_color': parsed_result.get('grid_color', [None] * 81),
-            'grid_size': parsed_result.get('grid_size', [0] * 81),
-        }
-        parsed_grids.append(stripped)
-
-        try:
-            ai_result = analyze_training_image(image_path)
-            ai_results.append(ai_result)
-        except Exception as e:
-            logger.exception("AI analysis failed for %s", image_path)
-            ai_results.append({'error': str(e)})
+    EXAMINATION_IMAGES.observe(len(image_paths))
+    with (
+        ANALYZE_REQUESTS_IN_PROGRESS.track_inprogress(endpoint='analyze'),
+        ANALYZE_SECONDS.time(endpoint='analyze'),
+        collect() as timings,
+    ):
+        # Read each file once for both grid parsing and Gemini
+        with stage('load'):
+            items = await load_batch(image_paths)
+        await start_metadata_job(str(examination_id), image_paths, items)
+        with stage('parse_grids'):
+            parsed_grids = await parse_grids_async(items)
+        if parsed_grids:
+            with stage('scoring'):
+                accumulated = accumulate_disease_scores(parsed_grids)
+            with stage('save'):
+                await asave_analysis(
+                    str(examination_id), parsed_grids, accumulated,
+                )
+    log_timings(
+        'analyze', timings,
+        examination_id=str(examination_id),
+        image_count=len(image_paths),
+        success=bool(parsed_grids),
+    )
 
     if not parsed_grids:
         return JsonResponse({'error': '所有圖片處理失敗'}, status=500)
 
-    accumulated = accumulate_disease_scores(parsed_grids)
+    redirect_url = reverse(
+        'diagnosis:result', kwargs={'examination_id': examination_id}
+    )
+    return JsonResponse({'success': True, 'redirect_url': redirect_url})
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event."""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f'event: {event}\ndata: {payload}\n\n'
+
+
+def _ranking_summary(accumulated: dict) -> dict:
+    """Disease ranking per hand, without report text, for progress events."""
+    by_id = get_compiled_diseases().by_id
+    summary = {}
+    for hand in ('left_hand', 'right_hand'):
+        hand_result = accumulated[hand]
+        scores = {entry['id']: entry for entry in hand_result['scores']}
+        summary[hand] = [
+            {
+                'id': disease_id,
+                'name_zh': by_id[disease_id]['name_zh'],
+                'score': scores[disease_id]['score'],
+                'severity': scores[disease_id]['severity'],
+            }
+            for disease_id in (
+                hand_result['possible_ids'] + hand_result['attention_ids']
+            )
+            if disease_id in by_id
+        ]
+    return summary
 
-    request.session['parsed_grids'] = parsed_grids
-    request.session['ai_results'] = ai_results
-    request.session['accumulated_scores'] = accumulated
 
+async def _analysis_events(examination_id, image_paths):
+    """Run the batch analysis, yielding SSE events as each image completes."""
     redirect_url = reverse(
         'diagnosis:result', kwargs={'examination_id': examination_id}
     )
-    return JsonResponse({'success': True, 'redirect_url': redirect_url})
+    parsed_grids: list[dict | None] = []
+    accumulator = MedianGridAccumulator()
+    completed = 0
+    # The generator may resume in a different context, so stages are
+    # recorded into timings explicitly rather than bound with collect()
+    timings = StageTimings() if TIMING_ENABLED else None
+    start = time.perf_counter()
+    ANALYZE_REQUESTS_IN_PROGRESS.inc(endpoint='analyze_stream')
+
+    try:
+        # Read each file once for both grid parsing and Gemini
+        with stage('load', timings):
+            items = await load_batch(image_paths)
+        await start_metadata_job(str(examination_id), image_paths, items)
+        # Closing the stream on disconnect cancels the grids still pending
+        async with aclosing(iter_analysis_async(items)) as events:
+            while True:
+                with stage('parse_grids', timings):
+                    event = await anext(events, None)
+                if event is None:
+                    break
+                if event[0] == 'start':
+                    parsed_grids = [None] * event[1]
+                    yield _sse_event('start', {'image_count': event[1]})
+                elif event[0] == 'grid':
+                    _, index, grid = event
+                    parsed_grids[index] = grid
+                    completed += 1
+                    with stage('scoring', timings):
+                        accumulator.add(grid)
+                        merged_color, merged_size = accumulator.median_grid()
+                        partial = score_merged_grid(
+                            merged_color, merged_size, completed,
+                        )
+                        ranking = _ranking_summary(partial)
+                    yield _sse_event('grid', {
+                        'index': index,
+                        'completed': completed,
+                        'image_count': len(parsed_grids),
+                        'grid': grid,
+                        'merged_grid': partial['merged_grid'],
+                        'ranking': ranking,
+                    })
+
+        if parsed_grids:
+            with stage('scoring', timings):
+                accumulated = accumulate_disease_scores(parsed_grids)
+            with stage('save', timings):
+                await asave_analysis(
+                    str(examination_id), parsed_grids, accumulated,
+                )
+        ANALYZE_SECONDS.observe(
+            time.perf_counter() - start, endpoint='analyze_stream',
+        )
+        log_timings(
+            'analyze_stream', timings,
+            examination_id=str(examination_id),
+            image_count=len(parsed_grids),
+            success=bool(parsed_grids),
+        )
+    finally:
+        ANALYZE_REQUESTS_IN_PROGRESS.dec(endpoint='analyze_stream')
+
+    if not parsed_grids:
+        yield _sse_event('error', {'error': '所有圖片處理失敗'})
+        return
+
+    yield _sse_event('done', {'success': True, 'redirect_url': redirect_url})
+
+
+@require_POST
+async def analyze_stream_api(request, examination_id):
+    """
+    Streaming variant of analyze_api using server-sent events.
+
+    Emits each image's parsed grid as soon as it is ready, together with
+    the merged grid and disease ranking so far, then a final event with
+    the result page URL once every grid is done. Metadata extraction
+    runs in the background as for analyze_api, started once the stream
+    has read the files.
+    """
+    examination = await _aowned_examination(
+        await request.session.aget('examination_id'), examination_id,
+    )
+    if examination is None:
+        return JsonResponse({'error': '無效的分析請求'}, status=400)
+
+    if examination['accumulated_scores']:
+        redirect_url = reverse(
+            'diagnosis:result', kwargs={'examination_id': examination_id}
+        )
+        return JsonResponse({'success': True, 'redirect_url': redirect_url})
+
+    image_paths = examination['image_paths']
+    if not image_paths:
+        return JsonResponse({'error': '找不到上傳的圖片'}, status=400)
+
+    EXAMINATION_IMAGES.observe(len(image_paths))
+    response = StreamingHttpResponse(
+        _analysis_events(examination_id, image_paths),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def metadata_api(request, examination_id):
+    """
+    Status of the background metadata extraction for an examination.
+
+    Returns {'status': 'pending'} until Gemini has answered for every
+    image, then {'status': 'done', 'ai_results': [...]}. Restarts the
+    job if it was lost.
+    """
+    examination = await _aowned_examination(
+        await request.session.aget('examination_id'), examination_id,
+    )
+    if examination is None:
+        return JsonResponse({'error': '無效的分析請求'}, status=400)
+
+    job = await aget_metadata_job(str(examination_id))
+    if job is None or job['status'] != METADATA_DONE:
+        await start_metadata_job(
+            str(examination_id), examination['image_paths'],
+        )
+        return JsonResponse({'status': 'pending'})
+
+    return JsonResponse({
+        'status': METADATA_DONE, 'ai_results': job['ai_results'],
+    })
 
 
 @never_cache
 def result_view(request, examination_id):
     """Result page displaying accumulated diagnosis results."""
-    session_exam_id = request.session.get('examination_id')
-    if session_exam_id != str(examination_id):
+    examination = _owned_examination(
+        request.session.get('examination_id'), examination_id,
+    )
+    if examination is None:
         messages.error(request, '無效的分析請求')
         return redirect('diagnosis:upload')
 
-    operator_name = request.session.get('operator_name', '未知')
-    ai_results = request.session.get('ai_results', [])
-    accumulated = request.session.get('accumulated_scores', {})
-    parsed_grids = request.session.get('parsed_grids', [])
+    operator_name = examination.get('operator_name') or '未知'
+    # Stored scores are compact; disease text comes from the catalog
+    accumulated = expand_disease_results(
+        examination.get('accumulated_scores') or {}
+    )
+    parsed_grids = examination.get('parsed_grids') or []
+
+    # Metadata may still be running; render placeholders and poll for it
+    job = get_metadata_job(str(examination_id))
+    ai_results = None
+    if job is not None and job['status'] == METADATA_DONE:
+        ai_results = job['ai_results']
+    ai_pending = ai_results is None
+    if ai_pending:
+        ai_results = [{} for _ in parsed_grids or [None]]
 
     has_error = not any(g.get('success') for g in parsed_grids) if parsed_grids else True
 
-    image_paths = request.session.get('image_paths', [])
+    image_paths = examination['image_paths']
     image_urls = []
     for path in image_paths:
         if path and os.path.exists(path):
@@ -241,6 +463,7 @@ def result_view(request, examination_id):
         'examination_id': examination_id,
         'operator_name': operator_name,
         'ai_results': ai_results,
+        'ai_pending': ai_pending,
         'has_error': has_error,
         'left_hand': left_hand,
         'right_hand': right_hand,
@@ -263,10 +486,67 @@ def diseases_view(request):
     return render(request, 'diagnosis/diseases.html', {'diseases': diseases})
 
 
+# Rendered verify-page entries, keyed by image content and parameters
+_verify_cache = ResultCache('analyze_verify', max_entries=32)
+
+
+def _verify_entry(image_path: Path) -> dict:
+    """Build (or fetch from cache) the verify-page entry for one image."""
+    source = ImageSource.from_path(image_path)
+    cache_key = content_key(source.data, detection_params_version())
+    entry = _verify_cache.get(cache_key)
+    if entry is not None:
+        entry['filename'] = image_path.name
+        return entry
+
+    result = process_image(source)
+
+    if 'error' in result:
+        entry = {
+            'filename': image_path.name,
+            'error': result['error']
+        }
+    else:
+        viz = result['visualization']
+        _, buffer = cv2.imencode('.jpg', viz)
+        viz_base64 = base64.b64encode(
+            buffer
+        ).decode('utf-8')
+
+        # Test inputs are JPEGs already; embed the original bytes as-is
+        orig_base64 = base64.b64encode(
+            source.data
+        ).decode('utf-8')
+
+        grid_info = result['grid_info']
+        entry = {
+            'filename': image_path.name,
+            'original_base64': orig_base64,
+            'visualization_base64': viz_base64,
+            'grid_info': {
+                'bounds': [int(v) for v in grid_info['bounds']],
+                'cell_size': [float(v) for v in grid_info['cell_size']],
+            },
+            'grid_color': (
+                result['analysis']['grid_color']
+            ),
+            'grid_size': (
+                result['analysis']['grid_size']
+            ),
+            'cell_details': (
+                result['analysis']['cell_details']
+            ),
+        }
+
+    _verify_cache.set(cache_key, entry)
+    return entry
+
+
 def analyze_verify_view(request):
     """
     Proof of concept page for grid detection testing.
     Processes test images and displays detection results.
+    Entries are cached by image content, so reloads skip processing.
     """
     test_images_dir = Path(settings.BASE_DIR) / 'data' / 'test_inputs'
     results = []
@@ -275,46 +555,7 @@ def analyze_verify_view(request):
         image_paths = sorted(test_images_dir.glob('*.jpeg'))
 
         for image_path in image_paths:
-            result = process_image(str(image_path))
-
-            if 'error' in result:
-                results.append({
-                    'filename': image_path.name,
-                    'error': result['error']
-                })
-            else:
-                viz = result['visualization']
-                _, buffer = cv2.imencode('.jpg', viz)
-                viz_base64 = base64.b64encode(
-                    buffer
-                ).decode('utf-8')
-
-                original = cv2.imread(str(image_path))
-                _, orig_buffer = cv2.imencode('.jpg', original)
-                orig_base64 = base64.b64encode(
-                    orig_buffer
-                ).decode('utf-8')
-
-                results.append({
-                    'filename': image_path.name,
-                    'original_base64': orig_base64,
-                    'visualization_base64': viz_base64,
-                    'grid_info': {
-                        'bounds': result['grid_info']['bounds'],
-                        'cell_size': (
-                            result['grid_info']['cell_size']
-                        ),
-                    },
-                    'grid_color': (
-                        result['analysis']['grid_color']
-                    ),
-                    'grid_size': (
-                        result['analysis']['grid_size']
-                    ),
-                    'cell_details': (
-                        result['analysis']['cell_details']
-                    ),
-                })
+            results.append(_verify_entry(image_path))
 
     return render(request, 'diagnosis/analyze_verify.html', {
         'results': results,
@@ -365,3 +606,24 @@ def score_simulator_api(request):
     return render(
         request, 'diagnosis/_score_results.html', result,
     )
+
+
+@never_cache
+def metrics_view(request):
+    """
+    Prometheus text-format metrics of this process.
+
+    Not found unless METRICS_TOKEN or METRICS_PUBLIC is configured.
+    """
+    if METRICS_TOKEN:
+        if not hmac.compare_digest(
+            request.headers.get('Authorization', ''),
+            f'Bearer {METRICS_TOKEN}',
+        ):
+            return HttpResponse(status=401)
+    elif not METRICS_PUBLIC:
+        return HttpResponse(status=404)
+    return HttpResponse(
+        REGISTRY.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )